@@ -1,40 +1,124 @@
-from app.service import Service
+from app.service import Service, settings
+from app.search import SearchEngine, card_text, document_text
+from app.counters import CardDelta, apply_delta, category_name
+from app.content import pack, unpack
+from app.writebehind import WriteBehindBuffer
+from app.profiling import timed
 
 from fastapi import HTTPException
 
 from functools import wraps
 
-from sqlalchemy import select, asc, desc, inspect, or_, and_
-from sqlalchemy.orm import selectinload
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import (select, update, delete, insert, literal, asc, desc, inspect, or_, and_, exists, func,
+                        type_coerce, String)
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import selectinload, joinedload, contains_eager, undefer_group
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 
 from app.db import async_session
 from app.api.schemas import CardContent, CardMeta, UserCreate, UserAuth
-from app.api.notes import Card, Category, Tag, User
+from app.api.notes import Card, Category, Tag, User, OwnerCardCount, OwnerFacetCount, tag_table
 
 
 from contextlib import asynccontextmanager
 
-from typing import Optional, Any
+from datetime import datetime, timedelta, timezone
 
+from typing import Callable, Optional, Any
+
+import asyncio
 import logging
 
 
 logger = logging.getLogger(__name__)
 
+search_engine = SearchEngine(max_users=settings.SEARCH_INDEX_MAX_USERS, ttl=settings.SEARCH_INDEX_TTL)
+
+_change_listeners: list[Callable[[int], None]] = []
+
+def on_cards_changed(listener: Callable[[int], None]) -> Callable[[int], None]:
+    """Регистрирует обработчик, вызываемый с owner_id после записи карточек."""
+    _change_listeners.append(listener)
+    return listener
+
+def _cards_changed(owner_id: int) -> None:
+    for listener in _change_listeners:
+        listener(owner_id)
+
+def _pending_flushed(owner_id: int) -> None:
+    search_engine.invalidate(owner_id)
+    _cards_changed(owner_id)
+
+# Колонки ответа на обновление, без содержания.
+_SUMMARY_COLUMNS = (Card.id, Card.title, Card.subtitle, Card.content_size,
+                    Card.tag_names, Card.category_id, Card.created_at)
+_CONTENT_COLUMNS = (Card.__table__.c.content, Card.__table__.c.content_z)
+
+def _column_values(fields: dict) -> dict:
+    """Значения колонок card_object для полей title/subtitle/content."""
+    values = {key: value for key, value in fields.items() if key != 'content'}
+    if 'content' in fields:
+        values['content'], values['content_z'], values['content_size'] = pack(fields['content'])
+    return values
+
+def _summary(row, cat_name: Optional[str], pending: Optional[dict] = None) -> dict:
+    """Поля CardSummaryResponse из строки _SUMMARY_COLUMNS с наложением патча."""
+    summary = {key: getattr(row, key)
+               for key in ('id', 'title', 'subtitle', 'content_size', 'tag_names', 'created_at')}
+    summary['category'] = ({'id': row.category_id, 'cat_name': cat_name}
+                           if row.category_id is not None else None)
+    for key, value in (pending or {}).items():
+        if key == 'content':
+            summary['content_size'] = len(value.encode()) if value is not None else None
+        else:
+            summary[key] = value
+    return summary
+
+def _full_card_options(full: bool) -> tuple:
+    """Опции загрузки для CardResponse: содержание и тэги (устаревшие ответы)."""
+    return (undefer_group('content'), selectinload(Card.tags)) if full else ()
+
+def _match_compressed(q: str, rows) -> list[int]:
+    """id карточек, в сжатом содержании которых есть q без учета регистра."""
+    needle = q.casefold()
+    return [card_id for card_id, compressed in rows if needle in unpack(None, compressed).casefold()]
+
+def _with_pending(cards):
+    """Накладывает на карточки патчи, еще не записанные write-behind."""
+    if len(write_behind):
+        for card in cards:
+            fields = write_behind.overlay(card.owner_id, card.id)
+            for key, value in (fields or {}).items():
+                setattr(card, key, value)
+    return cards
+
 def handle_db_errors(func):
     @wraps(func)
     async def wrapper(*args, **kwargs):
         try:
             return await func(*args, **kwargs)
         except SQLAlchemyError as e:
-            logger.error(f'Ошибка в БД {func.__name__}: {e}', exc_info=True)
+            logger.error('Ошибка в БД %s: %s', func.__name__, e, exc_info=True)
             raise HTTPException(status_code=500, detail='Ошибка базы данных')
         except Exception as e:
-            logger.critical(f'Критическая ошибка в {func.__name__}: {e}', exc_info=True)
+            logger.critical('Критическая ошибка в %s: %s', func.__name__, e, exc_info=True)
             raise HTTPException(status_code=500, detail='Внутрення ошибка сервера')
     return wrapper
 
+def _has_tag(session, tag: str):
+    """Условие 'у карточки есть тэг' по копии tag_names (GIN на Postgres)."""
+    if session.bind.dialect.name == 'postgresql':
+        return type_coerce(Card.tag_names, ARRAY(String)).contains([tag])
+    names = func.json_each(Card.tag_names).table_valued('value')
+    return exists(select(1).select_from(names).where(names.c.value == tag))
+
+def _tag_names_ilike(session, pattern: str):
+    """Условие ILIKE по именам тэгов из копии tag_names."""
+    if session.bind.dialect.name == 'postgresql':
+        return func.array_to_string(Card.tag_names, ' ').ilike(pattern)
+    names = func.json_each(Card.tag_names).table_valued('value')
+    return exists(select(1).select_from(names).where(names.c.value.ilike(pattern)))
+
 @asynccontextmanager
 async def get_db_transaction():
     async with async_session() as session:
@@ -77,14 +161,44 @@ class CardDAO:
         async with get_db_session() as session:
             stmt = select(Card).options(
                 selectinload(Card.category),
-                selectinload(Card.tags)).where(and_(Card.id == card_id, Card.owner_id == owner_id))
-            logger.debug(stmt)
+                selectinload(Card.tags),
+                undefer_group('content')).where(and_(Card.id == card_id, Card.owner_id == owner_id,
+                                                     Card.deleted_at.is_(None)))
+            logger.debug('%s', stmt)
             result = await session.execute(stmt)
             card = result.scalar_one_or_none()
             if card is None:
                 raise HTTPException(status_code=404, detail='Карточка не найдена')
+        _with_pending((card,))
         return card
 
+    @classmethod
+    @handle_db_errors
+    async def get_card_content_from_bd(cls, card_id: int, owner_id: int) -> tuple[Optional[str], Optional[bytes], int]:
+        """Возвращает хранимое содержание карточки без распаковки.
+
+        Args:
+            card_id: id карточки
+            owner_id: id пользователя
+        Returns:
+            tuple: (текст, сжатые байты, размер в байтах)
+        Raises:
+            HTTPException: При отсутствии карточки
+        """
+        async with get_db_session() as session:
+            stmt = (select(Card._content, Card.content_z, Card.content_size)
+                    .where(Card.id == card_id, Card.owner_id == owner_id, Card.deleted_at.is_(None)))
+            row = (await session.execute(stmt)).one_or_none()
+        if row is None:
+            raise HTTPException(status_code=404, detail='Карточка не найдена')
+        text, compressed, size = row
+        pending = write_behind.overlay(owner_id, card_id)
+        if pending and 'content' in pending:
+            text, compressed, size = pack(pending['content'])
+        if size is None:
+            size = len(text.encode()) if text is not None else 0
+        return text, compressed, size
+
     @classmethod
     @handle_db_errors
     async def get_cards_from_bd(cls, owner_id: int, order: str = 'desc',
@@ -92,7 +206,8 @@ class CardDAO:
                                 cat: Optional[str] = None,
                                 tag: Optional[str] = None,
                                 limit: int = 5,
-                                offset: int = 0,) -> list[Card]:
+                                offset: int = 0,
+                                full: bool = False) -> list[Card]:
         """Получает все записи из БД и сортирует.
 
         Args:
@@ -103,12 +218,12 @@ class CardDAO:
             owner_id: id пользователя
             limit: ограничение количества карт
             offset: смещение
+            full: Загрузить содержание и тэги (для CardResponse)
         Returns:
             cards: Отсортированный список записей
         Raises:
             HTTPException: При ошибках валидации или БД
         """
-        print(owner_id)
         valid_columns = {col.key for col in inspect(Card).mapper.column_attrs}
         if sort_by not in valid_columns:
             raise HTTPException(
@@ -116,27 +231,67 @@ class CardDAO:
                 detail='Недопустивый параметр сортировки')
 
         async with get_db_session() as session:
-            stmt = select(Card).options(
-                selectinload(Card.category),
-                selectinload(Card.tags)).where(Card.owner_id == owner_id)
-            if cat and tag:
-                stmt = (
-                    stmt.join(Card.category)
-                    .join(Card.tags)
-                    .where(and_(Category.cat_name == cat, Tag.tag_name == tag))
-                )
-            elif cat:
-                stmt = stmt.join(Card.category).where(Category.cat_name == cat)
-            elif tag:
-                stmt = stmt.join(Card.tags).where(Tag.tag_name == tag)
+            stmt = (select(Card).options(joinedload(Card.category), *_full_card_options(full))
+                    .where(Card.owner_id == owner_id, Card.deleted_at.is_(None)))
+            if cat:
+                stmt = stmt.where(Card.category_id == select(Category.id)
+                                  .where(Category.cat_name == cat).scalar_subquery())
+            if tag:
+                stmt = stmt.where(_has_tag(session, tag))
 
             col = getattr(Card, sort_by)
             stmt = stmt.order_by(desc(col) if order.lower() == 'desc' else asc(col))
             stmt = stmt.limit(limit).offset(offset)
 
-            res = await session.execute(stmt.distinct())
-            cards = res.scalars().unique().all()
-        return cards
+            res = await session.execute(stmt)
+            cards = res.scalars().all()
+        return _with_pending(cards)
+    @classmethod
+    @handle_db_errors
+    async def get_card_counts_from_bd(cls, owner_id: int) -> dict:
+        """Возвращает количество карточек пользователя из таблиц счетчиков.
+
+        Args:
+            owner_id: id пользователя
+        Returns:
+            dict: total, tags {имя: количество}, categories {имя: количество}
+        """
+        async with get_db_session() as session:
+            total = await session.scalar(
+                select(OwnerCardCount.total).where(OwnerCardCount.owner_id == owner_id))
+            result = await session.execute(
+                select(OwnerFacetCount.kind, OwnerFacetCount.name, OwnerFacetCount.count)
+                .where(OwnerFacetCount.owner_id == owner_id, OwnerFacetCount.count > 0))
+            facets = {'tag': {}, 'cat': {}}
+            for kind, name, count in result:
+                facets[kind][name] = count
+        return {'total': total or 0, 'tags': facets['tag'], 'categories': facets['cat']}
+
+    @classmethod
+    @handle_db_errors
+    async def count_cards_from_bd(cls, owner_id: int, cat: Optional[str] = None,
+                                  tag: Optional[str] = None) -> Optional[int]:
+        """Количество карточек под фильтр по счетчикам, без COUNT(*).
+
+        Args:
+            owner_id: id пользователя
+            cat: Категория
+            tag: тэг
+        Returns:
+            int | None: None, если заданы и категория, и тэг
+        """
+        if cat and tag:
+            return None
+        if cat or tag:
+            stmt = select(OwnerFacetCount.count).where(
+                OwnerFacetCount.owner_id == owner_id,
+                OwnerFacetCount.kind == ('cat' if cat else 'tag'),
+                OwnerFacetCount.name == (cat or tag))
+        else:
+            stmt = select(OwnerCardCount.total).where(OwnerCardCount.owner_id == owner_id)
+        async with get_db_session() as session:
+            return await session.scalar(stmt) or 0
+
     @classmethod
     @handle_db_errors
     async def create_card_in_bd(cls, title: str, subtitle: str, content: str, owner_id: int,
@@ -157,57 +312,113 @@ class CardDAO:
         Raises:
             HTTPException: При ошибках валидации или БД
         """
-        async with get_db_transaction() as session:
-            category = None
-            tag_objs = []
-
-            if attr:
-                if attr.get('cat'):
-                    category = await Service.get_or_create_category(session, attr['cat'])
-
-                if attr.get('tag'):
-                    tag_objs = [
-                        await Service.get_or_create_tag(session, t)
-                        for t in attr['tag']
-                    ]
-
-            card = Card(title=title, subtitle=subtitle, content=content,
-                        category=category, tags=tag_objs, owner_id=owner_id)
-
-            session.add(card)
-            await session.flush()
-        logger.info(f'Запись с {card.id} создана')
+        for attempt in range(2):
+            try:
+                async with get_db_transaction() as session:
+                    category = None
+                    tag_objs = []
+
+                    if attr:
+                        if attr.get('cat'):
+                            category = await Service.get_or_create_category(session, attr['cat'])
+
+                        if attr.get('tag'):
+                            tag_objs = await Service.get_or_create_tags(session, attr['tag'])
+
+                    card = Card(title=title, subtitle=subtitle, content=content,
+                                category=category, tags=tag_objs, owner_id=owner_id,
+                                tag_names=[t.tag_name for t in tag_objs])
+
+                    session.add(card)
+                    await session.flush()
+                    version = await apply_delta(session, owner_id, CardDelta().card(
+                        1, card.tag_names, category.cat_name if category else None))
+                break
+            except IntegrityError as e:
+                # Тэг или категорию удалил сборщик мусора между SELECT и INSERT
+                # (на Postgres это исключает FOR KEY SHARE) - повторяем один раз.
+                if attempt:
+                    raise
+                logger.warning('Повтор создания карточки после IntegrityError: %s', e.orig)
+        search_engine.card_saved(owner_id, card.id, card_text(card), version)
+        _cards_changed(owner_id)
+        logger.info('Запись с %s создана', card.id)
         return card
 
     @classmethod
     async def delete_card_from_bd(cls, card_id: int, owner_id: int) -> Card:
-        """Удаляет карточку в БД.
+        """Мягко удаляет карточку: одним UPDATE ставит deleted_at.
+
+        Строка и связи card_tag удаляются фоновой очисткой после
+        CARD_RETENTION_DAYS, до этого карточку можно восстановить.
 
         Args:
             card_id: Первичный ключ записи
             owner_id: id пользователя
         Returns:
-            Bool
+            Card: Удаленная карточка
         Raises:
             HTTPException: При ошибках валидации или БД
         """
         async with get_db_transaction() as session:
-            stmt = select(Card).where(Card.id == card_id, Card.owner_id == owner_id)
-            card = await session.execute(stmt)
-            card = card.scalar_one_or_none()
+            stmt = (update(Card)
+                    .where(Card.id == card_id, Card.owner_id == owner_id, Card.deleted_at.is_(None))
+                    .values(deleted_at=datetime.now(timezone.utc))
+                    .returning(Card))
+            card = (await session.execute(stmt)).scalar_one_or_none()
             if card is None:
-                logger.warning(f'Запись с {card_id} не найдена')
+                logger.warning('Запись с %s не найдена', card_id)
                 raise HTTPException(status_code=404, detail='Карточка не найдена')
-            await session.delete(card)
+            version = await apply_delta(session, owner_id, CardDelta().card(
+                -1, card.tag_names, await category_name(session, card.category_id)))
+
+        search_engine.card_deleted(owner_id, card_id, version)
+        write_behind.discard(owner_id, card_id)
+        _cards_changed(owner_id)
+        logger.info('Запись с %s удалена', card_id)
+        return card
+
+    @classmethod
+    @handle_db_errors
+    async def restore_card_in_bd(cls, card_id: int, owner_id: int) -> Card:
+        """Восстанавливает мягко удаленную карточку в пределах срока хранения.
 
-        logger.info(f'Запись с {card_id} удалена')
+        Args:
+            card_id: Первичный ключ записи
+            owner_id: id пользователя
+        Returns:
+            Card: Восстановленная карточка
+        Raises:
+            HTTPException: Если удаленной карточки нет или срок хранения истек
+        """
+        cutoff = datetime.now(timezone.utc) - timedelta(days=settings.CARD_RETENTION_DAYS)
+        async with get_db_transaction() as session:
+            stmt = (update(Card)
+                    .where(Card.id == card_id, Card.owner_id == owner_id,
+                           Card.deleted_at.is_not(None), Card.deleted_at > cutoff)
+                    .values(deleted_at=None)
+                    .returning(Card))
+            card = (await session.execute(stmt)).scalar_one_or_none()
+            if card is None:
+                raise HTTPException(status_code=404, detail='Удаленная карточка не найдена')
+            await session.refresh(card, attribute_names=['category'])
+            await apply_delta(session, owner_id, CardDelta().card(
+                1, card.tag_names, card.category.cat_name if card.category else None))
+
+        search_engine.invalidate(owner_id)
+        _cards_changed(owner_id)
+        logger.info('Запись с %s восстановлена', card_id)
         return card
 
     @classmethod
     @handle_db_errors
     async def update_card_in_bd(cls, card_id: int, owner_id: int, data: Optional[CardContent] = None,
-                                meta: Optional[CardMeta] = None) -> bool:
-        """Обновляет карточку в БД.
+                                meta: Optional[CardMeta] = None) -> Optional[dict]:
+        """Обновляет карточку в БД без загрузки ее в ORM.
+
+        Правка только title/subtitle/content - один UPDATE ... RETURNING.
+        Смена тэгов применяется к card_tag множествами (DELETE/INSERT по id),
+        смена категории - заменой category_id.
 
         Args:
             card_id: Первичный ключ записи
@@ -220,73 +431,220 @@ class CardDAO:
                 category: Категория
                 tags: Список тэгов
         Returns:
-            Bool
+            dict | None: Поля карточки после обновления (CardSummaryResponse) или None, если карточки нет
         Raises:
             HTTPException: При ошибках валидации или БД
         """
+        fields = data.model_dump(exclude_unset=True) if data else {}
+        cat = meta.cat if meta and meta.cat else None
+        tags = list(dict.fromkeys(meta.tag)) if meta and meta.tag else None
+        live = (Card.id == card_id, Card.owner_id == owner_id, Card.deleted_at.is_(None))
+
+        if settings.WRITE_BEHIND_ENABLED and fields and not (cat or tags):
+            async with get_db_session() as session:
+                row = (await session.execute(select(*_SUMMARY_COLUMNS).where(*live))).one_or_none()
+                if row is None:
+                    return None
+                cat_name = await category_name(session, row.category_id)
+            pending = {**(write_behind.overlay(owner_id, card_id) or {}), **fields}
+            _cards_changed(owner_id)
+            await write_behind.submit(owner_id, card_id, fields)
+            return _summary(row, cat_name, pending)
+        if write_behind.has(owner_id, card_id):
+            await write_behind.flush((owner_id, card_id))
+
+        values = _column_values(fields)
+        indexed = search_engine.is_indexed(owner_id)
+        returning = (*_SUMMARY_COLUMNS, *_CONTENT_COLUMNS) if indexed else _SUMMARY_COLUMNS
+        delta = CardDelta()
         async with get_db_transaction() as session:
-            stmt = (select(Card)
-                    .options(selectinload(Card.tags), selectinload(Card.category))
-                    .where(Card.id == card_id, Card.owner_id == owner_id))
-            card = await session.execute(stmt)
-            card = card.scalar_one_or_none()
-            if not card:
-                return False
-
-            if meta and meta.cat:
-                category = await Service.get_or_create_category(session, meta.cat)
-                card.category = category
+            if cat or tags:
+                old = (await session.execute(
+                    select(Card.tag_names, Card.category_id).where(*live).with_for_update())).one_or_none()
+                if old is None:
+                    return None
+                if cat:
+                    category = await Service.get_or_create_category(session, cat)
+                    await session.flush()
+                    values['category_id'] = category.id
+                    delta.recategorize(await category_name(session, old.category_id), cat)
+                if tags:
+                    tag_objs = await Service.get_or_create_tags(session, tags)
+                    await session.flush()
+                    tag_ids = [tag.id for tag in tag_objs]
+                    await session.execute(
+                        delete(tag_table)
+                        .where(tag_table.c.card_id == card_id, tag_table.c.tag_id.not_in(tag_ids)))
+                    await session.execute(
+                        insert(tag_table).from_select(
+                            ['card_id', 'tag_id'],
+                            select(literal(card_id), Tag.id)
+                            .where(Tag.id.in_(tag_ids),
+                                   ~exists().where(tag_table.c.card_id == card_id,
+                                                   tag_table.c.tag_id == Tag.id))))
+                    values['tag_names'] = tags
+                    delta.retag(old.tag_names or (), tags)
+
+            if values:
+                stmt = update(Card.__table__).where(*live).values(**values).returning(*returning)
+            else:
+                stmt = select(*returning).where(*live)
+            row = (await session.execute(stmt)).one_or_none()
+            if row is None:
+                return None
+            cat_name = cat or await category_name(session, row.category_id)
+            version = await apply_delta(session, owner_id, delta)
+
+        if indexed:
+            search_engine.card_saved(owner_id, card_id, document_text(
+                row.title, row.subtitle, unpack(row.content, row.content_z), cat_name, row.tag_names), version)
+        else:
+            search_engine.invalidate(owner_id)
+        _cards_changed(owner_id)
+        logger.info('Запись с id %s обновлена', card_id)
+        return _summary(row, cat_name)
 
-            if meta and meta.tag:
-                new_tags = set(meta.tag)
-                current_tags = {t.tag_name: t for t in card.tags}
-
-                for tag_name in new_tags - current_tags.keys():
-                    tag = await Service.get_or_create_tag(session, tag_name)
-                    card.tags.append(tag)
-
-                for tag_name in current_tags.keys() - new_tags:
-                    card.tags.remove(current_tags[tag_name])
+    @classmethod
+    @handle_db_errors
+    async def write_pending_to_bd(cls, items: list[tuple[int, int, dict]]) -> dict[tuple[int, int], Exception]:
+        """Записывает патчи write-behind одной транзакцией.
 
-            if data:
-                for key, value in data.model_dump(exclude_unset=True).items():
-                    setattr(card, key, value)
+        Каждая карточка пишется в своей точке сохранения: ошибка одной
+        не откатывает остальные.
 
-        logger.info(f'Запись с id {card_id} обновлена')
-        return True
+        Args:
+            items: Тройки (owner_id, card_id, поля title/subtitle/content)
+        Returns:
+            dict: Ошибки по (owner_id, card_id)
+        """
+        errors = {}
+        async with get_db_transaction() as session:
+            for owner_id, card_id, fields in items:
+                try:
+                    async with session.begin_nested():
+                        result = await session.execute(
+                            update(Card.__table__)
+                            .where(Card.id == card_id, Card.owner_id == owner_id, Card.deleted_at.is_(None))
+                            .values(**_column_values(fields)))
+                        if result.rowcount:
+                            await apply_delta(session, owner_id, CardDelta())
+                except SQLAlchemyError as e:
+                    errors[owner_id, card_id] = e
+        return errors
 
     @classmethod
     @handle_db_errors
-    async def search_cards_in_bd(cls, q: str, owner_id: int) -> list[Card]:
-        """Поиск карточки по тексту(ilike).
+    async def search_cards_in_bd(cls, q: str, owner_id: int, full: bool = False) -> list[Card]:
+        """Поиск карточки по тексту(ilike или триграммный индекс).
+
+        Содержание больше порога хранится сжатым в content_z, ILIKE по нему
+        невозможен. Кандидаты среди сжатых текстов отбираются триграммным
+        индексом владельца, загружаются и проверяются вне цикла событий только
+        они. Запрос без слова из 3+ символов сжатые тексты не находит.
 
             Args:
                 q: Текст
                 owner_id: id пользователя
+                full: Загрузить содержание и тэги (для CardResponse)
             Raises:
                 HTTPExecption: Если карточка не найдена
             Returns:
                 list[Card]
         """
+        if settings.SEARCH_ENGINE == 'trigram':
+            return await cls._search_cards_by_trigrams(q, owner_id, full)
+
         async with get_db_session() as session:
-            stmt = select(Card).where(Card.owner_id == owner_id)
+            live = (Card.owner_id == owner_id, Card.deleted_at.is_(None))
             stmt = (
-                stmt
-                .options(selectinload(Card.category), selectinload(Card.tags))
+                select(Card).where(*live)
                 .outerjoin(Card.category)
-                .outerjoin(Card.tags)
+                .options(contains_eager(Card.category), *_full_card_options(full))
                 .where(or_(
                     Card.title.ilike(f"%{q}%"),
                     Card.subtitle.ilike(f"%{q}%"),
-                    Card.content.ilike(f"%{q}%"),
+                    Card._content.ilike(f"%{q}%"),
                     Category.cat_name.ilike(f"%{q}%"),
-                    Tag.tag_name.ilike(f"%{q}%"),
+                    _tag_names_ilike(session, f"%{q}%"),
                 )
                 )
             )
-            logger.debug(stmt)
+            logger.debug('%s', stmt)
             result = await session.execute(stmt)
-        return result.scalars().unique().all()
+            cards = list(result.scalars().unique().all())
+
+        version = await cls.get_cards_version_from_bd(owner_id)
+        candidates = await search_engine.candidates(owner_id, q, cls.get_search_documents_from_bd, version)
+        candidates = (candidates or set()) - {card.id for card in cards}
+        if candidates:
+            async with get_db_session() as session:
+                rows = (await session.execute(
+                    select(Card.id, Card.content_z)
+                    .where(*live, Card.content_z.is_not(None), Card.id.in_(candidates)))).all()
+                matched = await asyncio.to_thread(_match_compressed, q, rows) if rows else []
+                if matched:
+                    result = await session.execute(
+                        select(Card).options(joinedload(Card.category), *_full_card_options(full))
+                        .where(*live, Card.id.in_(matched)))
+                    cards.extend(result.scalars().all())
+        return _with_pending(cards)
+
+    @classmethod
+    async def _search_cards_by_trigrams(cls, q: str, owner_id: int, full: bool = False) -> list[Card]:
+        version = await cls.get_cards_version_from_bd(owner_id)
+        ranked = await search_engine.search(owner_id, q, cls.get_search_documents_from_bd, version,
+                                            threshold=settings.SEARCH_TRGM_THRESHOLD)
+        if not ranked:
+            return []
+        order = {card_id: pos for pos, (card_id, _) in enumerate(ranked)}
+        async with get_db_session() as session:
+            stmt = (select(Card)
+                    .options(joinedload(Card.category), *_full_card_options(full))
+                    .where(Card.owner_id == owner_id, Card.id.in_(order), Card.deleted_at.is_(None)))
+            result = await session.execute(stmt)
+            cards = result.scalars().all()
+        return _with_pending(sorted(cards, key=lambda card: order[card.id]))
+
+    @classmethod
+    async def get_cards_version_from_bd(cls, owner_id: int) -> int:
+        """Версия карточек пользователя, общая для всех воркеров.
+
+        Меняется в транзакции любой записи карточек пользователя (apply_delta)
+        и читается по первичному ключу; по ней проверяются поисковый индекс и
+        кэш фрагментов.
+
+        Args:
+            owner_id: id пользователя
+        Returns:
+            int: Версия, 0 - у пользователя еще не было записей
+        """
+        async with get_db_session() as session:
+            version = await session.scalar(
+                select(OwnerCardCount.version).where(OwnerCardCount.owner_id == owner_id))
+        return version or 0
+
+    @classmethod
+    async def get_search_documents_from_bd(cls, owner_id: int) -> list[tuple[int, str]]:
+        """Возвращает тексты всех карточек пользователя для поискового индекса.
+
+        Args:
+            owner_id: id пользователя
+        Returns:
+            list: Пары (id карточки, текст)
+        """
+        async with get_db_session() as session:
+            stmt = (select(Card)
+                    .options(joinedload(Card.category), undefer_group('content'))
+                    .where(Card.owner_id == owner_id, Card.deleted_at.is_(None)))
+            result = await session.execute(stmt)
+            return [(card.id, card_text(card)) for card in result.scalars()]
+
+
+write_behind = WriteBehindBuffer(CardDAO.write_pending_to_bd,
+                                 window=settings.WRITE_BEHIND_WINDOW,
+                                 durability=settings.WRITE_BEHIND_DURABILITY,
+                                 max_pending=settings.WRITE_BEHIND_MAX_PENDING,
+                                 on_flushed=_pending_flushed)
 
 
 class UserDAO:
@@ -313,11 +671,13 @@ class UserDAO:
         Raises:
             HTTPException в случае неудачи регистрации
         """
+        with timed('bcrypt'):
+            hashed_password = await Service.hash_password(userdata.password)
         async with get_db_transaction() as session:
             user = User(
                 username=userdata.username,
                 email=userdata.email,
-                hashed_password=await Service.hash_password(userdata.password))
+                hashed_password=hashed_password)
             session.add(user)
             await session.flush()
             await session.refresh(user)
@@ -341,7 +701,11 @@ class UserDAO:
         async with get_db_session() as session:
             result = await session.execute(stmt)
             user = result.scalars().first()
-        if not user or not await Service.verify_method(userdata.password, user.hashed_password):
+        verified = False
+        if user is not None:
+            with timed('bcrypt'):
+                verified = await Service.verify_method(userdata.password, user.hashed_password)
+        if not verified:
             raise HTTPException(status_code=401, detail='Неверный логин или пароль')
         return int(user.id)
 
@@ -0,0 +1,39 @@
+from fastapi import APIRouter, HTTPException, Path
+from fastapi.responses import FileResponse
+
+from typing import Annotated, Any
+
+from app.auth import auth
+from app.profiling import get_profile_store
+
+
+router = APIRouter()
+
+"""
+Роутер администратора: сохраненные профили запросов
+"""
+
+
+async def _require_admin(uid) -> None:
+    user = await uid
+    if user is None or not user.is_admin:
+        raise HTTPException(status_code=403, detail='Требуются права администратора')
+
+
+@router.get('/profiles/', tags=['admin'])
+async def list_profiles(uid = auth.CURRENT_SUBJECT) -> Any:
+    """Обработчик. Сводки сохраненных профилей, новые первыми."""
+    await _require_admin(uid)
+    return get_profile_store().list()
+
+
+@router.get('/profiles/{profile_id}', tags=['admin'])
+async def download_profile(profile_id: Annotated[str, Path(max_length=40)],
+                           uid = auth.CURRENT_SUBJECT):
+    """Обработчик. Отдает файл pstats (python -m pstats <файл>, snakeviz)."""
+    await _require_admin(uid)
+    path = get_profile_store().prof_path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail='Профиль не найден')
+    return FileResponse(path, media_type='application/octet-stream',
+                        filename=f'{profile_id}.prof')
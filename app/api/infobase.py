@@ -1,16 +1,19 @@
 import logging
 
-from authx.schema import RequestToken
+from authx.schema import RequestToken, TokenPayload
 
 from fastapi import APIRouter, Request, Form, Depends, HTTPException
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
 
-from app.api.template import templates
-from app.api.schemas import UserCreate, UserAuth, as_form
+from app.api.template import templates, render, fragment_cache
+from app.profiling import timed
+from app.api.schemas import UserCreate, UserAuth, FilterParams, as_form
 from app.site_data import menu_items
-from app.DAO import CardDAO, UserDAO
+from app.DAO import CardDAO, UserDAO, on_cards_changed
 from app.auth import auth
 
+from markupsafe import Markup
+
 from pydantic import EmailStr
 
 from typing import Annotated
@@ -20,11 +23,12 @@ router = APIRouter()
 """Основные обработчик / """
 logger = logging.getLogger(__name__)
 templates.env.globals['menu'] = menu_items
+on_cards_changed(fragment_cache.invalidate)
 
 @router.get('/registration/', tags=['pages'],
             response_class=HTMLResponse)
 async def reg(request: Request):
-    return templates.TemplateResponse('reg_form.html', {'request': request})
+    return await render(request, 'reg_form.html')
 
 
 @router.post('/register_form/', tags=['pages'],
@@ -42,13 +46,20 @@ async def reg_form(
 @router.get('/auth/', tags=['pages'],
             response_class=HTMLResponse)
 async def log(request: Request):
-    return templates.TemplateResponse('login_form.html', {'request': request})
+    return await render(request, 'login_form.html')
+
+def _drop_access_token(request: Request) -> None:
+    """Удаляет текущий access-токен запроса из кэша проверенных токенов."""
+    token = request.cookies.get(auth.config.JWT_ACCESS_COOKIE_NAME)
+    if token:
+        auth.invalidate_token(token)
 
 @router.post('/login_form/', tags=['pages'])
-async def login(userdata: Annotated[UserAuth, Depends(as_form)]):
+async def login(request: Request, userdata: Annotated[UserAuth, Depends(as_form)]):
     user_id = await UserDAO.login_user_in_db(userdata)
     response = RedirectResponse(url='/cards/', status_code=303)
-    
+    _drop_access_token(request)
+
     access_token = auth.create_access_token(uid=str(user_id))
     refresh_token = auth.create_refresh_token(uid=str(user_id))
 
@@ -57,20 +68,43 @@ async def login(userdata: Annotated[UserAuth, Depends(as_form)]):
 
     return response
 
+@router.post('/refresh/', tags=['pages'])
+async def refresh(request: Request, payload: Annotated[TokenPayload, Depends(auth.refresh_token_required)]):
+    """Выдает новый access-токен по refresh-токену, старый удаляется из кэша."""
+    _drop_access_token(request)
+    response = JSONResponse({'detail': 'Токен обновлен'})
+    auth.set_access_cookies(token=auth.create_access_token(uid=payload.sub), response=response)
+    return response
+
+@router.post('/logout/', tags=['pages'])
+async def logout(request: Request):
+    _drop_access_token(request)
+    response = RedirectResponse(url='/auth/', status_code=303)
+    auth.unset_cookies(response)
+    return response
+
 
 @router.get('/profile', tags=['pages'],
             response_class=HTMLResponse)
 async def index(request: Request):
-    return templates.TemplateResponse('index.html', {'request': request})
+    return await render(request, 'index.html')
 
 
 @router.get('/cards/', tags=['pages'],)
 async def cards(request: Request, uid = auth.CURRENT_SUBJECT):
     try:
         uid = await uid
-        card_list = await CardDAO.get_cards_from_bd(owner_id=uid.id)
-        template = templates.TemplateResponse('user.html', {'request': request,
-                                                        'cards': card_list})
-        return template
+        version = await CardDAO.get_cards_version_from_bd(uid.id)
+        fragment = fragment_cache.get(uid.id, version)
+        if fragment is None:
+            generation = fragment_cache.begin(uid.id)
+            card_list = await CardDAO.get_cards_from_bd(owner_id=uid.id, **FilterParams().model_dump())
+            with timed('templates'):
+                html = await templates.get_template('cards.html').render_async(cards=card_list)
+            fragment = (Markup(html), len(card_list))
+            fragment_cache.set(uid.id, fragment, generation, version)
+        cards_html, count = fragment
+        return await render(request, 'user.html', {'cards_html': cards_html,
+                                                   'cards_count': count})
     except Exception as e:
         raise HTTPException(401, detail={"message": str(e)}) from e
@@ -1,7 +1,11 @@
 from app.base import Base
+from app.content import pack, unpack
 from sqlalchemy import func, text
-from sqlalchemy import Integer, Column, String, DateTime, Text, ForeignKey, Table
+from sqlalchemy import Integer, Column, String, DateTime, Text, ForeignKey, Table, LargeBinary, JSON, Index
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import relationship, Mapped, mapped_column
+from datetime import datetime
 from typing import Optional
 
 tag_table = Table(
@@ -26,11 +30,25 @@ class User(Base):
 
 class Card(Base):
     __tablename__ = 'card_object'
+    __table_args__ = (
+        Index('ix_card_object_tag_names', 'tag_names', postgresql_using='gin'),
+        # Чтения CardDAO идут только по неудаленным карточкам.
+        Index('ix_card_object_owner_live', 'owner_id', 'id',
+              postgresql_where=text('deleted_at IS NULL'),
+              sqlite_where=text('deleted_at IS NULL')),
+        Index('ix_card_object_deleted_at', 'deleted_at',
+              postgresql_where=text('deleted_at IS NOT NULL'),
+              sqlite_where=text('deleted_at IS NOT NULL')),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     title: Mapped[Optional[str]] = mapped_column(String(15)) 
     subtitle: Mapped[Optional[str]] = mapped_column(String(30))
-    content: Mapped[Optional[str]] = mapped_column(Text)
+    _content: Mapped[Optional[str]] = mapped_column('content', Text, deferred=True,
+                                                    deferred_group='content')
+    content_z: Mapped[Optional[bytes]] = mapped_column(LargeBinary, deferred=True,
+                                                       deferred_group='content')
+    content_size: Mapped[Optional[int]] = mapped_column(Integer)
 
     owner_id: Mapped[int] = mapped_column(Integer, ForeignKey('users.id'))
 
@@ -42,12 +60,33 @@ class Card(Base):
         back_populates='cards',
         passive_deletes=True
     )
+    # Копия имен тэгов из card_tag для чтения списков без join.
+    tag_names: Mapped[list[str]] = mapped_column(
+        JSON().with_variant(ARRAY(String(12)), 'postgresql'),
+        default=list, nullable=False)
 
     created_at: Mapped[str] = mapped_column(DateTime(timezone=True),
                         server_default=func.now(), nullable=False) 
     updated_at: Mapped[str] = mapped_column(DateTime(timezone=True),
                         server_default=func.now(), onupdate=func.now())
-    
+    # Мягкое удаление: строка удаляется фоновой очисткой после срока хранения.
+    deleted_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+
+    @hybrid_property
+    def content(self) -> Optional[str]:
+        """Содержание карточки. Требует загрузки группы 'content' (undefer_group)."""
+        return unpack(self._content, self.content_z)
+
+    @content.inplace.setter
+    def _content_setter(self, value: Optional[str]) -> None:
+        self._content, self.content_z, self.content_size = pack(value)
+
+    @content.inplace.expression
+    @classmethod
+    def _content_expression(cls):
+        # Только несжатое содержание: content_z в SQL не распаковать.
+        return cls._content
+
 
 class Category(Base):
     __tablename__ = 'category'
@@ -73,3 +112,25 @@ class Tag(Base):
         passive_deletes=True
     )
 
+
+class OwnerCardCount(Base):
+    """Количество карточек пользователя, ведется CardDAO в транзакции записи.
+
+    version растет при каждой записи карточек пользователя - по ней кэши
+    всех воркеров проверяют актуальность чтением по первичному ключу.
+    """
+    __tablename__ = 'owner_card_count'
+
+    owner_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    total: Mapped[int] = mapped_column(Integer, default=0, server_default=text('0'), nullable=False)
+    version: Mapped[int] = mapped_column(Integer, default=0, server_default=text('0'), nullable=False)
+
+
+class OwnerFacetCount(Base):
+    """Количество карточек пользователя по тэгу (kind='tag') или категории (kind='cat')."""
+    __tablename__ = 'owner_facet_count'
+
+    owner_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    kind: Mapped[str] = mapped_column(String(3), primary_key=True)
+    name: Mapped[str] = mapped_column(String(12), primary_key=True)
+    count: Mapped[int] = mapped_column(Integer, default=0, server_default=text('0'), nullable=False)
@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field, EmailStr, ConfigDict
 
-from typing import Optional, Literal, List
+from typing import Optional, Literal, List, Dict
 
 from datetime import datetime
 
@@ -73,6 +73,22 @@ class CardResponse(BaseModel):
     
     model_config = ConfigDict(from_attributes=True)
 
+class CardSummaryResponse(BaseModel):
+    id: int
+    title: Optional[str] = None
+    subtitle: Optional[str] = None
+    content_size: Optional[int] = None
+    category: Optional[CategoryResponse] = None
+    tag_names: List[str] = []
+    created_at: datetime
+
+    model_config = ConfigDict(from_attributes=True)
+
+class FacetsResponse(BaseModel):
+    total: int
+    tags: Dict[str, int]
+    categories: Dict[str, int]
+
 class FilterParams(BaseModel):
     order: Literal['desc', 'asc'] = 'desc'
     sort_by: Literal['created_at', 'id', 'title', 'subtitle'] = 'id'
@@ -1,3 +1,80 @@
+import time
+
+from collections import OrderedDict
+
+from fastapi import Request
+from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 
-templates = Jinja2Templates(directory='app/templates')
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+from typing import Any, Optional
+
+from app.assets import asset_url
+from app.profiling import timed
+from app.service import settings
+
+env = Environment(
+    loader=FileSystemLoader('app/templates'),
+    autoescape=True,
+    enable_async=True,
+    bytecode_cache=FileSystemBytecodeCache(),
+)
+templates = Jinja2Templates(env=env)
+templates.env.globals['asset_url'] = asset_url
+
+
+async def render(request: Request, name: str, context: Optional[dict] = None,
+                 status_code: int = 200) -> HTMLResponse:
+    """Асинхронно рендерит шаблон в HTMLResponse."""
+    with timed('templates'):
+        html = await templates.get_template(name).render_async({'request': request, **(context or {})})
+    return HTMLResponse(html, status_code=status_code)
+
+
+class FragmentCache:
+    """Кэш отрендеренных фрагментов по пользователям (LRU с TTL).
+
+    Фрагмент хранится вместе с версией данных из БД (например, количество
+    карточек и max(updated_at)) и отдается только при той же версии, поэтому
+    записи других воркеров видны сразу. invalidate() дополнительно сбрасывает
+    фрагмент при записях своего воркера, которых еще нет в БД (write-behind).
+
+    Значение, отрендеренное до инвалидации пользователя, не сохраняется:
+    begin() возвращает поколение, set() сверяет его с текущим.
+    """
+
+    def __init__(self, max_size: int = 1000, ttl: float = 30.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items: OrderedDict[int, tuple[float, Any, Any]] = OrderedDict()
+        self._generations: dict[int, int] = {}
+
+    def get(self, owner_id: int, version: Any = None) -> Any:
+        item = self._items.get(owner_id)
+        if item is None:
+            return None
+        expires, stored_version, value = item
+        if expires <= time.monotonic() or stored_version != version:
+            del self._items[owner_id]
+            return None
+        self._items.move_to_end(owner_id)
+        return value
+
+    def begin(self, owner_id: int) -> int:
+        return self._generations.get(owner_id, 0)
+
+    def set(self, owner_id: int, value: Any, generation: int, version: Any = None) -> None:
+        if self._generations.get(owner_id, 0) != generation:
+            return
+        self._items[owner_id] = (time.monotonic() + self.ttl, version, value)
+        self._items.move_to_end(owner_id)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def invalidate(self, owner_id: int) -> None:
+        self._items.pop(owner_id, None)
+        self._generations[owner_id] = self._generations.get(owner_id, 0) + 1
+
+
+fragment_cache = FragmentCache(max_size=settings.FRAGMENT_CACHE_SIZE, ttl=settings.FRAGMENT_CACHE_TTL)
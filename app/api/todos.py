@@ -1,16 +1,18 @@
-import traceback
-
 import logging
 
 from functools import wraps
 
-from fastapi import APIRouter, Query, Body, Path, HTTPException
+from fastapi import APIRouter, Query, Body, Path, HTTPException, Header, Response
+from fastapi.responses import StreamingResponse
 
-from typing import Optional, Annotated, List, Any
+from typing import Optional, Annotated, List, Any, Literal
 
-from app.api.schemas import CardContent, FilterParams, CardMeta, CardResponse, UserCreate, UserOut, CardRequest
+from app.api.schemas import (CardContent, FilterParams, CardMeta, CardResponse, CardSummaryResponse, FacetsResponse,
+                             UserCreate, UserOut, CardRequest)
 from app.auth import auth
 from app.DAO import CardDAO, UserDAO
+from app import dictionary
+from app.content import iter_bytes
 
 
 
@@ -30,8 +32,7 @@ def handle_resp_errors(func):
         except HTTPException:
             raise
         except Exception as e:
-            tb = traceback.format_exc() 
-            logger.error(f'Ошибка обработчика {func.__name__}: {e}\n{tb}')
+            logger.error('Ошибка обработчика %s: %s', func.__name__, e, exc_info=True)
             raise HTTPException(status_code=500,
                                 detail=f"Internal Server Error in {func.__name__}")
     return wrapper
@@ -82,21 +83,93 @@ async def get_card_by_id(card_id: Annotated[Optional[int], Path(...,)],
     return card
 
 
-@router.get('/get_card/',
-            tags=['Card'],
-            response_model=List[CardResponse])
+@router.get('/get_card/{card_id}/content',
+            tags=['Card'])
 @handle_resp_errors
-async def get_cards(uid = auth.CURRENT_SUBJECT,
-                    sort_param: Annotated[FilterParams, Query()] = None):
-    """Обработчик. Получает сортированный список карточек."""
+async def get_card_content(card_id: Annotated[int, Path(...)],
+                           uid = auth.CURRENT_SUBJECT,
+                           range_header: Annotated[Optional[str], Header(alias='Range')] = None):
+    """Обработчик. Отдает полное содержание карточки частями, поддерживает Range: bytes=a-b."""
     uid = await uid
+    text, compressed, size = await CardDAO.get_card_content_from_bd(card_id, uid.id)
+    headers = {'Accept-Ranges': 'bytes'}
+    media_type = 'text/plain; charset=utf-8'
+
+    if not range_header:
+        headers['Content-Length'] = str(size)
+        return StreamingResponse(iter_bytes(text, compressed), media_type=media_type, headers=headers)
+
+    try:
+        unit, _, spec = range_header.partition('=')
+        first, _, last = spec.strip().partition('-')
+        if unit.strip() != 'bytes' or ',' in spec:
+            raise ValueError
+        if first:
+            start, end = int(first), int(last) if last else size - 1
+        else:
+            start, end = max(size - int(last), 0), size - 1
+        end = min(end, size - 1)
+        if start > end:
+            raise ValueError
+    except ValueError:
+        raise HTTPException(status_code=416, detail='Недопустимый диапазон',
+                            headers={'Content-Range': f'bytes */{size}'})
+
+    headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    headers['Content-Length'] = str(end - start + 1)
+    return StreamingResponse(iter_bytes(text, compressed, start, end), status_code=206,
+                             media_type=media_type, headers=headers)
+
+
+async def _list_cards(response: Response, owner_id: int, sort_param: FilterParams, full: bool):
     if sort_param:
-        logger.info(sort_param)
+        logger.debug('%s', sort_param)
     data = sort_param.model_dump()
-    res =  await CardDAO.get_cards_from_bd(uid.id, **data)
+    res =  await CardDAO.get_cards_from_bd(owner_id, **data, full=full)
+    total = await CardDAO.count_cards_from_bd(owner_id, data['cat'], data['tag'])
+    if total is not None:
+        response.headers['X-Total-Count'] = str(total)
     return res
 
 
+@router.get('/get_card/',
+            tags=['Card'],
+            response_model=List[CardResponse],
+            deprecated=True)
+@handle_resp_errors
+async def get_cards(response: Response,
+                    uid = auth.CURRENT_SUBJECT,
+                    sort_param: Annotated[FilterParams, Query()] = None):
+    """Обработчик. Список карточек с содержанием и тэгами, прежний формат ответа.
+
+    Устарел: используйте /v2/get_card/.
+    """
+    uid = await uid
+    return await _list_cards(response, uid.id, sort_param, full=True)
+
+
+@router.get('/v2/get_card/',
+            tags=['Card'],
+            response_model=List[CardSummaryResponse])
+@handle_resp_errors
+async def get_card_summaries(response: Response,
+                             uid = auth.CURRENT_SUBJECT,
+                             sort_param: Annotated[FilterParams, Query()] = None):
+    """Обработчик. Получает сортированный список карточек, общее количество - в X-Total-Count."""
+    uid = await uid
+    return await _list_cards(response, uid.id, sort_param, full=False)
+
+
+@router.get('/facets/',
+            tags=['Card'],
+            response_model=FacetsResponse)
+@handle_resp_errors
+async def get_facets(uid = auth.CURRENT_SUBJECT):
+    """Обработчик. Количество карточек всего, по тэгам и категориям."""
+    uid = await uid
+    return await CardDAO.get_card_counts_from_bd(uid.id)
+
+
 @router.post('/create_card/',
              tags=['Card'],
              response_model=CardResponse,
@@ -121,21 +194,60 @@ async def delete_card(card_id: Annotated[int, Path(...)],
     return HTTPException(status_code=204, detail='Картчка удалена')
 
 
-@router.patch('/update_card/{card_id}', tags=['Card'])
+@router.post('/restore_card/{card_id}', tags=['Card'],
+             response_model=CardSummaryResponse)
+@handle_resp_errors
+async def restore_card(card_id: Annotated[int, Path(...)],
+                       uid = auth.CURRENT_SUBJECT):
+    """Обработчик. Восстанавливает удаленную карточку в пределах срока хранения."""
+    uid = await uid
+    return await CardDAO.restore_card_in_bd(card_id, uid.id)
+
+
+@router.patch('/update_card/{card_id}', tags=['Card'],
+              response_model=CardSummaryResponse)
 @handle_resp_errors
 async def update_card(card_id: Annotated[int, Path(...)],
                       uid = auth.CURRENT_SUBJECT,
                       data: Annotated[CardContent, Body(embed=True)] = None,
                       meta: Optional[CardMeta] = None):
-    """Обрабочтик. Частичное обновление записи."""
+    """Обрабочтик. Частичное обновление записи, возвращает карточку после обновления."""
     uid = await uid
-    await CardDAO.update_card_in_bd(card_id, uid.id, data, meta)
-    return HTTPException(status_code=200, detail='Обновление выполнено')
+    card = await CardDAO.update_card_in_bd(card_id, uid.id, data, meta)
+    if card is None:
+        raise HTTPException(status_code=404, detail='Карточка не найдена')
+    return card
 
-@router.get('/search_card/', tags=['Card'])
+@router.get('/search_card/', tags=['Card'],
+            response_model=List[CardResponse],
+            deprecated=True)
 @handle_resp_errors
 async def search_card(q: Annotated[str, Query(max_length=16)],
                       uid = auth.CURRENT_SUBJECT):
+    """Обработчик. Поиск карточки по тексту, прежний формат ответа.
+
+    Устарел: используйте /v2/search_card/.
+    """
+    uid = await uid
+    return await CardDAO.search_cards_in_bd(q, uid.id, full=True)
+
+
+@router.get('/v2/search_card/', tags=['Card'],
+            response_model=List[CardSummaryResponse])
+@handle_resp_errors
+async def search_card_summaries(q: Annotated[str, Query(max_length=16)],
+                                uid = auth.CURRENT_SUBJECT):
     """Обработчик. Поиск карточки по тексту"""
     uid = await uid
     return await CardDAO.search_cards_in_bd(q, uid.id)
+
+
+@router.get('/autocomplete/', tags=['Card'],
+            response_model=List[str],
+            dependencies=[auth.ACCESS_REQUIRED])
+async def autocomplete(q: Annotated[str, Query(max_length=12)],
+                       kind: Literal['tag', 'cat'] = 'tag',
+                       limit: Annotated[int, Query(ge=1, le=50)] = 10):
+    """Обработчик. Автодополнение тэгов и категорий по префиксу без запроса к БД."""
+    index = dictionary.tags if kind == 'tag' else dictionary.categories
+    return index.complete(q, limit)
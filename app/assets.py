@@ -0,0 +1,203 @@
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import stat
+
+import anyio
+
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+from starlette.types import Scope
+
+from typing import Optional
+
+try:
+    import brotli
+except ImportError:  # br-варианты собираются, только если установлен brotli
+    brotli = None
+
+"""
+Сборка статики: файлы из app/static копируются в каталог сборки под именами
+с хэшем содержимого, рядом кладутся сжатые .gz/.br варианты.
+
+    python -m app.assets [--src app/static] [--dest app/static_build]
+
+Сборка выполняется один раз при запуске (app.server или этой командой),
+воркеры только читают манифест. Файлы, которых нет ни в новом, ни в
+предыдущем манифесте, удаляются: предыдущая сборка остается для
+воркеров, еще не перезапущенных после деплоя.
+"""
+
+logger = logging.getLogger(__name__)
+
+STATIC_DIR = 'app/static'
+BUILD_DIR = 'app/static_build'
+MANIFEST_NAME = 'manifest.json'
+ASSETS_PREFIX = '/assets'
+STATIC_PREFIX = '/static'
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+COMPRESSIBLE = {'.css', '.js', '.mjs', '.json', '.svg', '.html', '.txt', '.map', '.xml'}
+MIN_COMPRESS_SIZE = 256
+
+_manifest: dict[str, str] = {}
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    """Пишет файл через временный, чтобы воркеры не видели его недописанным."""
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _hashed_name(rel_path: str, data: bytes) -> str:
+    root, ext = os.path.splitext(rel_path)
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    return f'{root}.{digest}{ext}'
+
+
+def build_assets(src: str = STATIC_DIR, dest: str = BUILD_DIR) -> dict[str, str]:
+    """Собирает статику с хэшами в именах и сжатыми вариантами.
+
+    Уже собранные файлы не переписываются, устаревшие удаляются.
+
+    Args:
+        src: Каталог исходной статики
+        dest: Каталог сборки
+    Returns:
+        dict: Манифест: исходный путь -> путь с хэшем (относительно каталогов)
+    """
+    manifest = {}
+    for dirpath, _, filenames in os.walk(src):
+        for filename in sorted(filenames):
+            full_path = os.path.join(dirpath, filename)
+            rel_path = os.path.relpath(full_path, src).replace(os.sep, '/')
+            with open(full_path, 'rb') as f:
+                data = f.read()
+            hashed = _hashed_name(rel_path, data)
+            manifest[rel_path] = hashed
+
+            target = os.path.join(dest, hashed)
+            if os.path.exists(target):
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            _write_atomic(target, data)
+            if os.path.splitext(filename)[1] in COMPRESSIBLE and len(data) >= MIN_COMPRESS_SIZE:
+                _write_atomic(f'{target}.gz', gzip.compress(data, compresslevel=9, mtime=0))
+                if brotli is not None:
+                    _write_atomic(f'{target}.br', brotli.compress(data, quality=11))
+            logger.info('Собран файл статики %s -> %s', rel_path, hashed)
+
+    os.makedirs(dest, exist_ok=True)
+    previous = _read_manifest(dest)
+    _write_atomic(os.path.join(dest, MANIFEST_NAME),
+                  json.dumps(manifest, indent=2, sort_keys=True).encode())
+    _prune(dest, set(manifest.values()) | set(previous.values()))
+    load_manifest(manifest)
+    return manifest
+
+
+def _read_manifest(dest: str) -> dict[str, str]:
+    try:
+        with open(os.path.join(dest, MANIFEST_NAME), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _prune(dest: str, keep: set[str]) -> None:
+    """Удаляет из каталога сборки файлы (и сжатые варианты) не из keep."""
+    keep = keep | {f'{name}{suffix}' for name in keep for suffix in ('.gz', '.br')} | {MANIFEST_NAME}
+    for dirpath, _, filenames in os.walk(dest):
+        for filename in filenames:
+            full_path = os.path.join(dirpath, filename)
+            rel_path = os.path.relpath(full_path, dest).replace(os.sep, '/')
+            if rel_path not in keep:
+                os.remove(full_path)
+                logger.info('Удален устаревший файл статики %s', rel_path)
+
+
+def load_manifest(manifest: Optional[dict[str, str]] = None, dest: str = BUILD_DIR) -> None:
+    """Загружает манифест сборки для asset_url (из словаря или с диска)."""
+    global _manifest
+    if manifest is None:
+        manifest = _read_manifest(dest)
+    _manifest = dict(manifest)
+
+
+def asset_url(path: str) -> str:
+    """URL файла статики для шаблонов.
+
+    Args:
+        path: Путь относительно app/static, например 'css/style.css'
+    Returns:
+        str: /assets/<путь с хэшем> или /static/<путь>, если файла нет в сборке
+    """
+    path = path.lstrip('/')
+    hashed = _manifest.get(path)
+    if hashed is None:
+        return f'{STATIC_PREFIX}/{path}'
+    return f'{ASSETS_PREFIX}/{hashed}'
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles, отдающий заранее сжатые .br/.gz варианты файлов.
+
+    С immutable=True ответы кэшируются браузером на год: имена файлов
+    содержат хэш, новая версия получает новый URL.
+    """
+
+    encodings = (('br', '.br'), ('gzip', '.gz'))
+
+    def __init__(self, *args, immutable: bool = False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.immutable = immutable
+
+    def _accepted(self, scope: Scope) -> list[tuple[str, str]]:
+        accept = Headers(scope=scope).get('accept-encoding', '')
+        offered = set()
+        for part in accept.split(','):
+            name, _, params = part.strip().partition(';')
+            params = params.strip().replace(' ', '')
+            if params.startswith('q='):
+                try:
+                    if float(params[2:]) == 0:
+                        continue
+                except ValueError:
+                    continue
+            offered.add(name.strip().lower())
+        return [(name, suffix) for name, suffix in self.encodings if name in offered]
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        response = None
+        if scope['method'] in ('GET', 'HEAD'):
+            for encoding, suffix in self._accepted(scope):
+                full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, path + suffix)
+                if stat_result and stat.S_ISREG(stat_result.st_mode):
+                    response = self.file_response(full_path, stat_result, scope)
+                    response.headers['content-encoding'] = encoding
+                    break
+        if response is None:
+            response = await super().get_response(path, scope)
+        response.headers['vary'] = 'Accept-Encoding'
+        if self.immutable and response.status_code in (200, 206, 304):
+            response.headers['cache-control'] = IMMUTABLE_CACHE_CONTROL
+        return response
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Сборка статики')
+    parser.add_argument('--src', default=STATIC_DIR)
+    parser.add_argument('--dest', default=BUILD_DIR)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    manifest = build_assets(args.src, args.dest)
+    print(f'Собрано файлов: {len(manifest)}')
+
+
+if __name__ == '__main__':
+    main()
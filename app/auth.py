@@ -1,9 +1,104 @@
-from authx import AuthX, AuthXConfig
+import hashlib
+import time
+
+from collections import OrderedDict
+from datetime import datetime
+from hmac import compare_digest
+
+from typing import Optional
+
+from authx import AuthX, AuthXConfig, RequestToken, TokenPayload
+from authx.exceptions import AccessTokenRequiredError, CSRFError, FreshTokenRequiredError, JWTDecodeError
 
 from app.service import settings
+from app.profiling import timed
 
 from app.DAO import UserDAO
 
+
+class CachedAuthX(AuthX):
+    """AuthX с кэшем проверенных access-токенов.
+
+    Подпись и claims токена проверяются один раз, payload хранится до exp
+    токена. При попадании в кэш повторяются только дешевые проверки:
+    nbf, тип, свежесть и CSRF. Выход и обновление токена удаляют старый
+    access-токен из кэша (invalidate_token), refresh-токены не кэшируются.
+    """
+
+    def __init__(self, config: AuthXConfig, cache_size: int = 10000):
+        super().__init__(config=config)
+        self.cache_size = cache_size
+        self._token_cache: OrderedDict[bytes, tuple[float, TokenPayload]] = OrderedDict()
+
+    @staticmethod
+    def _digest(token: str) -> bytes:
+        return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+    def invalidate_token(self, token: str) -> None:
+        """Удаляет токен из кэша (выход, отзыв или обновление токена)."""
+        self._token_cache.pop(self._digest(token), None)
+
+    def clear_token_cache(self) -> None:
+        self._token_cache.clear()
+
+    def _cached_payload(self, key: bytes) -> Optional[TokenPayload]:
+        entry = self._token_cache.get(key)
+        if entry is None:
+            return None
+        exp, payload = entry
+        if exp <= time.time():
+            del self._token_cache[key]
+            return None
+        self._token_cache.move_to_end(key)
+        return payload
+
+    @staticmethod
+    def _check_claims(token: RequestToken, payload: TokenPayload, verify_type: bool,
+                      verify_fresh: bool, verify_csrf: bool) -> None:
+        if payload.nbf is not None:
+            nbf = payload.nbf.timestamp() if isinstance(payload.nbf, datetime) else float(payload.nbf)
+            if nbf > time.time():
+                raise JWTDecodeError('Invalid token: The token is not yet valid (nbf)')
+        if verify_type and token.type != payload.type:
+            raise AccessTokenRequiredError(f"'{token.type}' token required, '{payload.type}' token received")
+        if verify_fresh and not payload.fresh:
+            raise FreshTokenRequiredError('Fresh token required')
+        if verify_csrf and token.location == 'cookies':
+            if token.csrf is None or payload.csrf is None:
+                raise CSRFError('Missing CSRF token in request')
+            if not compare_digest(token.csrf, payload.csrf):
+                raise CSRFError('CSRF token mismatch')
+
+    def verify_token(self, token: RequestToken, verify_type: bool = True,
+                     verify_fresh: bool = False, verify_csrf: bool = True) -> TokenPayload:
+        with timed('jwt'):
+            return self._verify_token(token, verify_type, verify_fresh, verify_csrf)
+
+    def _verify_token(self, token: RequestToken, verify_type: bool,
+                      verify_fresh: bool, verify_csrf: bool) -> TokenPayload:
+        if not self.cache_size or token.type != 'access':
+            return super().verify_token(token, verify_type=verify_type,
+                                        verify_fresh=verify_fresh, verify_csrf=verify_csrf)
+
+        key = self._digest(token.token)
+        payload = self._cached_payload(key)
+        if payload is not None:
+            try:
+                self._check_claims(token, payload, verify_type, verify_fresh, verify_csrf)
+            except (AccessTokenRequiredError, FreshTokenRequiredError, CSRFError, JWTDecodeError) as e:
+                e.login_type = self.login_type
+                raise
+            return payload
+
+        payload = super().verify_token(token, verify_type=verify_type,
+                                       verify_fresh=verify_fresh, verify_csrf=verify_csrf)
+        if payload.exp is not None:
+            self._token_cache[key] = (payload.expiry_datetime.timestamp(), payload)
+            while len(self._token_cache) > self.cache_size:
+                self._token_cache.popitem(last=False)
+        return payload
+
+
 config = AuthXConfig(
     JWT_ALGORITHM="HS256",
     JWT_SECRET_KEY=settings.SECRET_KEY,
@@ -11,6 +106,6 @@ config = AuthXConfig(
     JWT_COOKIE_CSRF_PROTECT=True,
 )
 
-auth = AuthX(config=config)
+auth = CachedAuthX(config=config, cache_size=settings.AUTH_TOKEN_CACHE_SIZE)
 
-auth.set_callback_get_model_instance(UserDAO.get_user_by_id)
\ No newline at end of file
+auth.set_callback_get_model_instance(UserDAO.get_user_by_id)
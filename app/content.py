@@ -0,0 +1,63 @@
+import zlib
+
+from typing import Iterator, Optional
+
+"""
+Хранение содержимого карточек: тексты больше порога сжимаются zlib.
+"""
+
+COMPRESS_THRESHOLD = 2048
+COMPRESS_LEVEL = 6
+CHUNK_SIZE = 64 * 1024
+
+
+def pack(text: Optional[str]) -> tuple[Optional[str], Optional[bytes], Optional[int]]:
+    """Готовит текст к записи в БД.
+
+    Args:
+        text: Содержание карточки
+    Returns:
+        tuple: (текст или None, сжатые байты или None, размер в байтах utf-8)
+    """
+    if text is None:
+        return None, None, None
+    raw = text.encode()
+    if len(raw) > COMPRESS_THRESHOLD:
+        return None, zlib.compress(raw, COMPRESS_LEVEL), len(raw)
+    return text, None, len(raw)
+
+
+def unpack(text: Optional[str], compressed: Optional[bytes]) -> Optional[str]:
+    if compressed is not None:
+        return zlib.decompress(compressed).decode()
+    return text
+
+
+def iter_bytes(text: Optional[str], compressed: Optional[bytes],
+               start: int = 0, end: Optional[int] = None,
+               chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Отдает байты содержания в диапазоне [start, end] частями.
+
+    Сжатое содержание распаковывается потоково, целиком в памяти
+    не собирается.
+    """
+    if compressed is None:
+        raw = (text or '').encode()
+        stop = len(raw) if end is None else end + 1
+        for pos in range(start, stop, chunk_size):
+            yield raw[pos:min(pos + chunk_size, stop)]
+        return
+
+    decompressor = zlib.decompressobj()
+    offset = 0
+    for pos in range(0, len(compressed), chunk_size):
+        data = decompressor.decompress(compressed[pos:pos + chunk_size])
+        if pos + chunk_size >= len(compressed):
+            data += decompressor.flush()
+        lo = max(start - offset, 0)
+        hi = len(data) if end is None else min(end + 1 - offset, len(data))
+        offset += len(data)
+        if lo < hi:
+            yield data[lo:hi]
+        if end is not None and offset > end:
+            return
@@ -0,0 +1,111 @@
+from collections import Counter
+
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import dictionary
+from app.api.notes import Category, OwnerCardCount, OwnerFacetCount
+
+from typing import Iterable, Optional
+
+"""
+Счетчики карточек пользователя: всего и по тэгам/категориям.
+Меняются в той же транзакции, что и сами карточки.
+"""
+
+
+def _insert(session, table):
+    dialect = postgresql if session.bind.dialect.name == 'postgresql' else sqlite
+    return dialect.insert(table)
+
+
+class CardDelta:
+    """Накопитель изменений счетчиков одной транзакции."""
+
+    def __init__(self):
+        self.total = 0
+        self.facets: Counter = Counter()
+
+    def card(self, sign: int, tags: Iterable[str] = (), cat: Optional[str] = None) -> 'CardDelta':
+        """Учитывает появление (sign=1) или исчезновение (sign=-1) карточки."""
+        self.total += sign
+        for tag in set(tags):
+            self.facets['tag', tag] += sign
+        if cat:
+            self.facets['cat', cat] += sign
+        return self
+
+    def retag(self, old: Iterable[str], new: Iterable[str]) -> 'CardDelta':
+        old, new = set(old), set(new)
+        for tag in new - old:
+            self.facets['tag', tag] += 1
+        for tag in old - new:
+            self.facets['tag', tag] -= 1
+        return self
+
+    def recategorize(self, old: Optional[str], new: Optional[str]) -> 'CardDelta':
+        if old != new:
+            if old:
+                self.facets['cat', old] -= 1
+            if new:
+                self.facets['cat', new] += 1
+        return self
+
+
+async def category_name(session, category_id: Optional[int]) -> Optional[str]:
+    """Имя категории по id: из словаря процесса, иначе запросом."""
+    if category_id is None:
+        return None
+    name = dictionary.categories.get_name(category_id)
+    if name is None:
+        result = await session.execute(select(Category.cat_name).where(Category.id == category_id))
+        name = result.scalar_one_or_none()
+    return name
+
+
+async def lock_owners(session, owner_ids: Iterable[int]) -> None:
+    """Блокирует строки owner_card_count пользователей до конца транзакции.
+
+    Недостающие строки создаются. Эту же блокировку берет apply_delta в
+    каждой записи карточек, поэтому записи пользователей ждут коммита.
+    """
+    owner_ids = sorted(set(owner_ids))
+    if not owner_ids:
+        return
+    stmt = _insert(session, OwnerCardCount).values([{'owner_id': owner_id, 'total': 0} for owner_id in owner_ids])
+    await session.execute(stmt.on_conflict_do_nothing(index_elements=[OwnerCardCount.owner_id]))
+    await session.execute(select(OwnerCardCount.owner_id)
+                          .where(OwnerCardCount.owner_id.in_(owner_ids))
+                          .order_by(OwnerCardCount.owner_id)
+                          .with_for_update())
+
+
+async def apply_delta(session, owner_id: int, delta: CardDelta) -> int:
+    """Применяет изменения счетчиков через upsert в текущей транзакции.
+
+    Вызывается при любой записи карточек, в том числе с пустым delta:
+    строка owner_card_count обновляется всегда, поэтому ее version
+    меняется вместе с карточками, а блокировка строки упорядочивает
+    записи одного пользователя (ее же берет reconcile_counters).
+    Строки фасетов пишутся одним запросом в фиксированном порядке, чтобы
+    параллельные транзакции одного пользователя не взаимоблокировались.
+
+    Returns:
+        int: Новая версия карточек пользователя
+    """
+    stmt = _insert(session, OwnerCardCount).values(owner_id=owner_id, total=delta.total, version=1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[OwnerCardCount.owner_id],
+        set_={'total': OwnerCardCount.total + stmt.excluded.total,
+              'version': OwnerCardCount.version + 1}).returning(OwnerCardCount.version)
+    version = (await session.execute(stmt)).scalar_one()
+
+    rows = [{'owner_id': owner_id, 'kind': kind, 'name': name, 'count': count}
+            for (kind, name), count in sorted(delta.facets.items()) if count]
+    if rows:
+        stmt = _insert(session, OwnerFacetCount).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[OwnerFacetCount.owner_id, OwnerFacetCount.kind, OwnerFacetCount.name],
+            set_={'count': OwnerFacetCount.count + stmt.excluded.count})
+        await session.execute(stmt)
+    return version
@@ -1,7 +1,14 @@
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+import os
+
+from typing import Optional
+
+from sqlalchemy import inspect
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from app.base import Base
-from app.service import settings
+from app.service import settings, BASE_DIR
+
+ALEMBIC_INI = os.path.join(os.path.dirname(BASE_DIR), 'alembic.ini')
 
 def get_db_url(async_mode: bool = True):
     driver = 'postgresql+asyncpg' if async_mode else 'posrgresql'
@@ -10,9 +17,105 @@ def get_db_url(async_mode: bool = True):
             f"{settings.DB_HOST}:{settings.DB_PORT}/{settings.DB_NAME}"
             )
 
-engine = create_async_engine(get_db_url(), echo=True)
-async_session = sessionmaker(engine, class_ = AsyncSession, expire_on_commit=False)
+_engine: Optional[AsyncEngine] = None
+_engine_pid: Optional[int] = None
+_session_factory = sessionmaker(class_ = AsyncSession, expire_on_commit=False)
+
+def get_engine() -> AsyncEngine:
+    """Возвращает движок текущего процесса.
+
+    Движок создается при первом обращении, поэтому каждый воркер после
+    fork получает собственный пул соединений. Пул, унаследованный от
+    родителя, отбрасывается без закрытия чужих сокетов.
+    """
+    global _engine, _engine_pid
+    pid = os.getpid()
+    if _engine is None or _engine_pid != pid:
+        if _engine is not None:
+            _engine.sync_engine.dispose(close=False)
+        _engine = create_async_engine(get_db_url(),
+                                      pool_size=settings.DB_POOL_SIZE,
+                                      max_overflow=settings.DB_MAX_OVERFLOW,
+                                      pool_pre_ping=True)
+        _engine_pid = pid
+        _session_factory.configure(bind=_engine)
+    return _engine
+
+def async_session() -> AsyncSession:
+    get_engine()
+    return _session_factory()
+
+async def dispose_engine():
+    """Закрывает соединения движка текущего процесса при остановке."""
+    global _engine, _engine_pid
+    if _engine is not None and _engine_pid == os.getpid():
+        await _engine.dispose()
+    _engine = None
+    _engine_pid = None
+
+def _create_all(sync_conn) -> None:
+    """create_all для новой БД с пометкой ревизией head.
+
+    Существующая БД не меняется: create_all не добавляет колонки, а
+    созданные им таблицы ломают последующий alembic upgrade.
+
+    Raises:
+        RuntimeError: Если БД не новая и ее ревизия не head
+    """
+    from alembic.config import Config
+    from alembic.runtime.migration import MigrationContext
+    from alembic.script import ScriptDirectory
+
+    script = ScriptDirectory.from_config(Config(ALEMBIC_INI))
+    context = MigrationContext.configure(sync_conn)
+    if not inspect(sync_conn).has_table('card_object'):
+        Base.metadata.create_all(sync_conn)
+        context.stamp(script, 'head')
+        return
+    current = set(context.get_current_heads())
+    if current != set(script.get_heads()):
+        raise RuntimeError(
+            f'Ревизия БД {sorted(current)} не совпадает с {sorted(script.get_heads())}. '
+            f'Выполните alembic upgrade head; БД без ревизии (созданную до миграций) '
+            f'сначала пометьте: alembic stamp 0001')
 
 async def init_db():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    async with get_engine().begin() as conn:
+        await conn.run_sync(_create_all)
+
+async def check_migrations():
+    """Сверяет ревизию БД с head миграций без выполнения DDL.
+
+    Raises:
+        RuntimeError: Если схема БД отстает от миграций
+    """
+    from alembic.config import Config
+    from alembic.runtime.migration import MigrationContext
+    from alembic.script import ScriptDirectory
+
+    heads = set(ScriptDirectory.from_config(Config(ALEMBIC_INI)).get_heads())
+    async with get_engine().connect() as conn:
+        current = await conn.run_sync(
+            lambda sync_conn: set(MigrationContext.configure(sync_conn).get_current_heads()))
+    if current != heads:
+        raise RuntimeError(
+            f'Ревизия БД {sorted(current)} не совпадает с {sorted(heads)}, '
+            f'выполните alembic upgrade head')
+
+async def prepare_db():
+    """Готовит БД к работе в зависимости от STARTUP_MODE.
+
+    Миграции после 0001 меняют существующие таблицы, create_all их не применяет.
+    БД, созданную до появления миграций (схема 0001), нужно один раз
+    пометить и обновить:
+
+        alembic stamp 0001
+        alembic upgrade head
+
+    В режиме create_all таблицы создаются только в новой БД, она сразу
+    помечается head; существующая БД, отстающая от head, не запускается.
+    """
+    if settings.STARTUP_MODE == 'migrations':
+        await check_migrations()
+    else:
+        await init_db()
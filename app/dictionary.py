@@ -0,0 +1,134 @@
+from bisect import bisect_left, insort
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session, object_session
+
+from app.api.notes import Category, Tag
+from app.db import async_session
+
+from typing import Iterable, Optional
+
+"""
+Словари тэгов и категорий в памяти процесса: id -> имя и отсортированный
+список имен для автодополнения по префиксу.
+
+Словари - кэш для чтения (автодополнение, имя категории для счетчиков).
+Путь записи id по словарю не берет: get_or_create_* в Service читает
+строки из БД с блокировкой, см. сборщик мусора в app.maintenance.
+Новые имена попадают в словарь после коммита своей транзакции; записи
+других воркеров и удаления сборщика мусора подтягиваются периодической
+перезагрузкой (DICTIONARY_REFRESH_INTERVAL).
+"""
+
+
+class NameIndex:
+    """Словарь id -> имя с поиском имен по префиксу через bisect."""
+
+    def __init__(self):
+        self._ids: dict[str, int] = {}
+        self._names: dict[int, str] = {}
+        self._keys: list[tuple[str, str]] = []
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def load(self, rows: Iterable[tuple[int, str]]) -> None:
+        """Полностью заменяет содержимое словаря.
+
+        Args:
+            rows: Пары (id, имя)
+        """
+        self._ids = {name: id_ for id_, name in rows if name is not None}
+        self._names = {id_: name for name, id_ in self._ids.items()}
+        self._keys = sorted((name.casefold(), name) for name in self._ids)
+
+    def add(self, id_: int, name: str) -> None:
+        if name is None or self._ids.get(name) == id_:
+            return
+        if name not in self._ids:
+            insort(self._keys, (name.casefold(), name))
+        self._ids[name] = id_
+        self._names[id_] = name
+
+    def discard(self, name: str) -> None:
+        id_ = self._ids.pop(name, None)
+        if id_ is None:
+            return
+        self._names.pop(id_, None)
+        pos = bisect_left(self._keys, (name.casefold(), name))
+        if pos < len(self._keys) and self._keys[pos][1] == name:
+            del self._keys[pos]
+
+    def get_name(self, id_: int) -> Optional[str]:
+        return self._names.get(id_)
+
+    def complete(self, prefix: str, limit: int = 10) -> list[str]:
+        """Возвращает до limit имен, начинающихся с prefix (без учета регистра).
+
+        Args:
+            prefix: Начало имени
+            limit: Максимум результатов
+        Returns:
+            list[str]: Имена в алфавитном порядке
+        """
+        key = prefix.casefold()
+        pos = bisect_left(self._keys, (key, ''))
+        result = []
+        for folded, name in self._keys[pos:pos + limit]:
+            if not folded.startswith(key):
+                break
+            result.append(name)
+        return result
+
+
+tags = NameIndex()
+categories = NameIndex()
+
+
+async def load_dictionaries(session) -> None:
+    """Загружает все тэги и категории из БД в словари процесса."""
+    result = await session.execute(select(Tag.id, Tag.tag_name))
+    tags.load(result.all())
+    result = await session.execute(select(Category.id, Category.cat_name))
+    categories.load(result.all())
+
+
+async def refresh_dictionaries() -> None:
+    """Перезагружает словари из БД: имена из других воркеров, удаления GC."""
+    async with async_session() as session:
+        await load_dictionaries(session)
+
+
+# after_insert срабатывает при flush, а не при коммите: имена копятся в
+# session.info и попадают в словарь только после коммита.
+_PENDING_KEY = 'dictionary_added'
+
+
+def _remember(target, index: NameIndex, name: str) -> None:
+    session = object_session(target)
+    if session is None:
+        return
+    session.info.setdefault(_PENDING_KEY, []).append((index, target.id, name))
+
+
+@event.listens_for(Tag, 'after_insert')
+def _tag_inserted(mapper, connection, target: Tag) -> None:
+    _remember(target, tags, target.tag_name)
+
+
+@event.listens_for(Category, 'after_insert')
+def _category_inserted(mapper, connection, target: Category) -> None:
+    _remember(target, categories, target.cat_name)
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_added(session) -> None:
+    for index, id_, name in session.info.pop(_PENDING_KEY, ()):
+        index.add(id_, name)
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _drop_added(session, transaction) -> None:
+    # Корневая транзакция закончилась без коммита (rollback или close).
+    if transaction.parent is None:
+        session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,136 @@
+import copy
+import json
+import logging
+import queue
+import random
+import sys
+
+from logging.handlers import QueueHandler, QueueListener
+
+from typing import Optional
+
+"""
+Неблокирующее логирование: записи уходят в очередь, форматирование
+и запись в stdout выполняются в фоновом потоке QueueListener.
+"""
+
+SQL_LOGGER = 'sqlalchemy.engine'
+
+_RESERVED_ATTRS = frozenset(vars(logging.makeLogRecord({})).keys()) | {'message', 'asctime'}
+_TRACEBACK_FORMATTER = logging.Formatter()
+
+
+class JsonFormatter(logging.Formatter):
+    """Форматирует запись в одну строку JSON."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            'ts': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith('_'):
+                payload[key] = value
+        if record.exc_info:
+            payload['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            payload['exc'] = record.exc_text
+        if record.stack_info:
+            payload['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает только долю debug-записей и SQL-логов.
+
+    Args:
+        rate: Доля записей, которые попадут в лог (0..1)
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG and not record.name.startswith(SQL_LOGGER):
+            return True
+        if record.levelno >= logging.WARNING:
+            return True
+        return random.random() < self.rate
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler, который отбрасывает запись при переполненной очереди
+    вместо ожидания. JSON собирается в потоке слушателя."""
+
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Как QueueHandler.prepare: args и exc_info ссылаются на живые объекты
+        # и кадры стека, поэтому сообщение и traceback вычисляются здесь.
+        record = copy.copy(record)
+        record.message = record.msg = record.getMessage()
+        if record.exc_info or record.exc_text:
+            record.exc = record.exc_text or _TRACEBACK_FORMATTER.formatException(record.exc_info)
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            NonBlockingQueueHandler.dropped += 1
+
+
+_listener: Optional[QueueListener] = None
+
+
+def setup_logging(level: str = 'INFO',
+                  levels: Optional[dict[str, str]] = None,
+                  sample_rate: float = 0.1,
+                  queue_size: int = 10000) -> QueueListener:
+    """Настраивает корневой логгер на запись через фоновую очередь.
+
+    Args:
+        level: Уровень корневого логгера
+        levels: Уровни отдельных логгеров {имя: уровень}
+        sample_rate: Доля debug- и SQL-записей, попадающих в лог
+        queue_size: Размер очереди, при переполнении записи отбрасываются
+    Returns:
+        QueueListener: Запущенный слушатель очереди
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter())
+
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=queue_size))
+    handler.addFilter(SamplingFilter(sample_rate))
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+
+    for name, lvl in (levels or {}).items():
+        logging.getLogger(name).setLevel(lvl.upper())
+
+    _listener = QueueListener(handler.queue, stream, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def shutdown_logging() -> None:
+    """Останавливает слушатель, дописывая оставшиеся в очереди записи."""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    _listener = None
@@ -1,10 +1,20 @@
 from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 
-from app.api import infobase, todos
-from app.db import init_db
+from app.api import admin, infobase, todos
+from app.assets import BUILD_DIR, STATIC_DIR, PrecompressedStaticFiles, load_manifest
+from app.db import prepare_db, dispose_engine, async_session
+from app.dictionary import load_dictionaries, refresh_dictionaries
 from app.auth import auth
+from app.logs import setup_logging, shutdown_logging
+from app.service import settings
+from app.maintenance import OrphanCollector, run_periodically, reconcile_counters, purge_deleted_cards
+from app.DAO import write_behind
+from app.profiling import ProfilingMiddleware, get_profile_store, instrument
+
+import asyncio
+
+from functools import partial
 
 from contextlib import asynccontextmanager
 
@@ -19,8 +29,46 @@ origins = [
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    await init_db()
-    yield
+    setup_logging(level=settings.LOG_LEVEL,
+                  levels=settings.LOG_LEVELS,
+                  sample_rate=settings.LOG_SAMPLE_RATE,
+                  queue_size=settings.LOG_QUEUE_SIZE)
+    load_manifest(dest=BUILD_DIR)
+    await prepare_db()
+    async with async_session() as session:
+        await load_dictionaries(session)
+
+    flusher = None
+    if settings.WRITE_BEHIND_ENABLED:
+        flusher = asyncio.create_task(write_behind.run())
+    tasks = []
+    if settings.DICTIONARY_REFRESH_INTERVAL > 0:
+        tasks.append(asyncio.create_task(
+            run_periodically(refresh_dictionaries, settings.DICTIONARY_REFRESH_INTERVAL, 'dictionaries')))
+    if settings.GC_INTERVAL > 0:
+        collector = OrphanCollector(batch_size=settings.GC_BATCH_SIZE,
+                                    lock_timeout_ms=settings.GC_LOCK_TIMEOUT_MS)
+        tasks.append(asyncio.create_task(
+            run_periodically(collector.collect, settings.GC_INTERVAL, 'gc')))
+    if settings.COUNTERS_RECONCILE_INTERVAL > 0:
+        tasks.append(asyncio.create_task(
+            run_periodically(reconcile_counters, settings.COUNTERS_RECONCILE_INTERVAL, 'counters')))
+    if settings.PURGE_INTERVAL > 0:
+        purge = partial(purge_deleted_cards, retention_days=settings.CARD_RETENTION_DAYS,
+                        batch_size=settings.PURGE_BATCH_SIZE)
+        tasks.append(asyncio.create_task(
+            run_periodically(purge, settings.PURGE_INTERVAL, 'purge')))
+    try:
+        yield
+    finally:
+        if flusher is not None:
+            await write_behind.close()
+            await flusher
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await dispose_engine()
+        shutdown_logging()
 
 app = FastAPI(title='Mini Hub', lifespan=lifespan)
 auth.handle_errors(app)
@@ -29,10 +77,22 @@ app.add_middleware(CORSMiddleware,
                    allow_methods=["*"],
                    allow_headers=["*"],
                    allow_credentials=True,
+                   expose_headers=["X-Total-Count"],
                    )
-app.mount('/static', StaticFiles(directory='app/static'), name='static')
+app.mount('/static', PrecompressedStaticFiles(directory=STATIC_DIR), name='static')
+app.mount('/assets', PrecompressedStaticFiles(directory=BUILD_DIR, check_dir=False, immutable=True),
+          name='assets')
 
 app.include_router(todos.router, prefix='/action')
 app.include_router(infobase.router)
 
+if settings.PROFILING_ENABLED:
+    instrument()
+    app.add_middleware(ProfilingMiddleware,
+                       store=get_profile_store(),
+                       token=settings.PROFILING_TOKEN,
+                       sample_rate=settings.PROFILING_SAMPLE_RATE,
+                       path_prefix=settings.PROFILING_PATH_PREFIX)
+    app.include_router(admin.router, prefix='/admin')
+
 
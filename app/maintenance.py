@@ -0,0 +1,356 @@
+import argparse
+import asyncio
+import logging
+import time
+
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select, update, delete, exists, text, func, union, insert
+from sqlalchemy.exc import DBAPIError
+
+from app import dictionary
+from app.DAO import get_db_transaction
+from app.counters import CardDelta, apply_delta, lock_owners
+from app.api.notes import Card, Category, Tag, tag_table, OwnerCardCount, OwnerFacetCount
+
+from typing import Awaitable, Callable
+
+"""
+Обслуживающие задачи БД.
+
+    python -m app.maintenance check-tags [--repair]
+    python -m app.maintenance gc
+    python -m app.maintenance reconcile-counters
+    python -m app.maintenance purge [--retention-days N]
+"""
+
+logger = logging.getLogger(__name__)
+
+
+async def check_tag_snapshots(repair: bool = False, batch_size: int = 500) -> int:
+    """Сверяет Card.tag_names с таблицей card_tag.
+
+    Args:
+        repair: Исправить расхождения, записав имена из card_tag
+        batch_size: Количество карточек в одной транзакции
+    Returns:
+        int: Количество карточек с расхождениями
+    """
+    started = time.perf_counter()
+    drifted = 0
+    last_id = 0
+    while True:
+        async with get_db_transaction() as session:
+            stmt = (select(Card.id, Card.tag_names, Card.owner_id)
+                    .where(Card.id > last_id)
+                    .order_by(Card.id)
+                    .limit(batch_size))
+            if repair:
+                stmt = stmt.with_for_update()
+            rows = (await session.execute(stmt)).all()
+            if not rows:
+                break
+
+            ids = [card_id for card_id, _, _ in rows]
+            actual = defaultdict(list)
+            result = await session.execute(
+                select(tag_table.c.card_id, Tag.tag_name)
+                .join(Tag, Tag.id == tag_table.c.tag_id)
+                .where(tag_table.c.card_id.in_(ids)))
+            for card_id, tag_name in result:
+                actual[card_id].append(tag_name)
+
+            for card_id, tag_names, owner_id in rows:
+                expected = sorted(actual.get(card_id, ()))
+                if sorted(tag_names or ()) == expected:
+                    continue
+                drifted += 1
+                logger.warning('Расхождение tag_names у карточки %s: %s != %s',
+                               card_id, tag_names, expected)
+                if repair:
+                    await session.execute(
+                        update(Card).where(Card.id == card_id).values(tag_names=expected))
+                    await apply_delta(session, owner_id, CardDelta())
+            last_id = ids[-1]
+
+    logger.info('Проверка tag_names: расхождений %s, исправлено %s, %.3f с',
+                drifted, drifted if repair else 0, time.perf_counter() - started)
+    return drifted
+
+
+async def reconcile_counters(batch_size: int = 200) -> int:
+    """Пересчитывает таблицы счетчиков по карточкам и исправляет дрейф.
+
+    Args:
+        batch_size: Количество пользователей в одной транзакции
+    Returns:
+        int: Количество пользователей, у которых счетчики расходились
+    """
+    started = time.perf_counter()
+    fixed = 0
+    last_owner = 0
+    owners = union(select(Card.owner_id.label('owner_id')),
+                   select(OwnerCardCount.owner_id.label('owner_id'))).subquery()
+    while True:
+        async with get_db_transaction() as session:
+            result = await session.execute(
+                select(owners.c.owner_id)
+                .where(owners.c.owner_id > last_owner)
+                .order_by(owners.c.owner_id)
+                .limit(batch_size))
+            ids = result.scalars().all()
+            if not ids:
+                break
+
+            # Снимок счетчиков и карточек читается под блокировкой владельцев:
+            # записи (в том числе только смена тэгов) ждут в apply_delta и
+            # применяют свою дельту уже поверх исправленных строк.
+            await lock_owners(session, ids)
+            stored = defaultdict(dict)
+            result = await session.execute(
+                select(OwnerCardCount.owner_id, OwnerCardCount.total)
+                .where(OwnerCardCount.owner_id.in_(ids)))
+            for owner_id, total in result:
+                if total:
+                    stored[owner_id]['total', ''] = total
+            result = await session.execute(
+                select(OwnerFacetCount.owner_id, OwnerFacetCount.kind,
+                       OwnerFacetCount.name, OwnerFacetCount.count)
+                .where(OwnerFacetCount.owner_id.in_(ids), OwnerFacetCount.count != 0))
+            for owner_id, kind, name, count in result:
+                stored[owner_id][kind, name] = count
+
+            actual = defaultdict(dict)
+            result = await session.execute(
+                select(Card.owner_id, func.count())
+                .where(Card.owner_id.in_(ids), Card.deleted_at.is_(None))
+                .group_by(Card.owner_id))
+            for owner_id, total in result:
+                actual[owner_id]['total', ''] = total
+            result = await session.execute(
+                select(Card.owner_id, Tag.tag_name, func.count())
+                .join(tag_table, tag_table.c.card_id == Card.id)
+                .join(Tag, Tag.id == tag_table.c.tag_id)
+                .where(Card.owner_id.in_(ids), Card.deleted_at.is_(None))
+                .group_by(Card.owner_id, Tag.tag_name))
+            for owner_id, name, count in result:
+                actual[owner_id]['tag', name] = count
+            result = await session.execute(
+                select(Card.owner_id, Category.cat_name, func.count())
+                .join(Category, Category.id == Card.category_id)
+                .where(Card.owner_id.in_(ids), Card.deleted_at.is_(None))
+                .group_by(Card.owner_id, Category.cat_name))
+            for owner_id, name, count in result:
+                actual[owner_id]['cat', name] = count
+
+            drifted = [owner_id for owner_id in ids if stored[owner_id] != actual[owner_id]]
+            if drifted:
+                fixed += len(drifted)
+                logger.warning('Дрейф счетчиков у пользователей %s', drifted)
+                # Строки owner_card_count не удаляются: их version читают кэши воркеров.
+                await session.execute(delete(OwnerFacetCount).where(OwnerFacetCount.owner_id.in_(drifted)))
+                facets = []
+                for owner_id in drifted:
+                    await session.execute(update(OwnerCardCount)
+                                          .where(OwnerCardCount.owner_id == owner_id)
+                                          .values(total=actual[owner_id].get(('total', ''), 0)))
+                    for (kind, name), count in actual[owner_id].items():
+                        if kind != 'total':
+                            facets.append({'owner_id': owner_id, 'kind': kind, 'name': name, 'count': count})
+                if facets:
+                    await session.execute(insert(OwnerFacetCount), facets)
+            last_owner = ids[-1]
+
+    logger.info('Сверка счетчиков: исправлено пользователей %s за %.3f с',
+                fixed, time.perf_counter() - started)
+    return fixed
+
+
+async def purge_deleted_cards(retention_days: float = 30, batch_size: int = 500) -> int:
+    """Окончательно удаляет карточки, мягко удаленные раньше срока хранения.
+
+    Связи card_tag и сами карточки удаляются пакетами, каждый пакет в своей
+    короткой транзакции; строки, заблокированные другими транзакциями,
+    пропускаются до следующего прохода.
+
+    Args:
+        retention_days: Срок хранения удаленных карточек, дни
+        batch_size: Количество карточек в одной транзакции
+    Returns:
+        int: Количество удаленных карточек
+    """
+    started = time.perf_counter()
+    cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
+    purged = 0
+    while True:
+        async with get_db_transaction() as session:
+            result = await session.execute(
+                select(Card.id)
+                .where(Card.deleted_at.is_not(None), Card.deleted_at < cutoff)
+                .order_by(Card.id)
+                .limit(batch_size)
+                .with_for_update(skip_locked=True))
+            ids = result.scalars().all()
+            if not ids:
+                break
+            await session.execute(delete(tag_table).where(tag_table.c.card_id.in_(ids)))
+            await session.execute(delete(Card).where(Card.id.in_(ids)))
+        purged += len(ids)
+        await asyncio.sleep(0)
+
+    logger.info('Очистка удаленных карточек: удалено %s за %.3f с',
+                purged, time.perf_counter() - started)
+    return purged
+
+
+@dataclass
+class CleanupStats:
+    tags: int = 0
+    categories: int = 0
+    seconds: float = 0.0
+
+
+async def _lock_for_batch(session, lock_timeout_ms: int) -> bool:
+    """Ограничивает ожидание блокировок и не дает воркерам чистить одновременно."""
+    if session.bind.dialect.name != 'postgresql':
+        return True
+    await session.execute(text(f"SET LOCAL lock_timeout = '{int(lock_timeout_ms)}ms'"))
+    result = await session.execute(select(func.pg_try_advisory_xact_lock(0x4855425F4743)))
+    return bool(result.scalar())
+
+
+class OrphanCollector:
+    """Удаляет тэги и категории, на которые не ссылается ни одна карточка.
+
+    Строка удаляется, только если она была без ссылок и на предыдущем
+    проходе: только что созданный тэг, который транзакция еще не успела
+    привязать к карточке, не будет удален.
+    """
+
+    def __init__(self, batch_size: int = 100, lock_timeout_ms: int = 200, max_scan: int = 10000):
+        self.batch_size = batch_size
+        self.lock_timeout_ms = lock_timeout_ms
+        self.max_scan = max_scan
+        self._suspects: dict[str, set[int]] = {'tag': set(), 'category': set()}
+
+    async def _orphans(self, kind: str) -> set[int]:
+        if kind == 'tag':
+            stmt = select(Tag.id).where(~exists().where(tag_table.c.tag_id == Tag.id))
+        else:
+            stmt = select(Category.id).where(~exists().where(Card.category_id == Category.id))
+        async with get_db_transaction() as session:
+            result = await session.execute(stmt.limit(self.max_scan))
+            return set(result.scalars())
+
+    async def _delete_batch(self, kind: str, ids: list[int]) -> list[tuple[int, str]]:
+        if kind == 'tag':
+            model, name, index = Tag, Tag.tag_name, dictionary.tags
+            still_orphan = ~exists().where(tag_table.c.tag_id == Tag.id)
+        else:
+            model, name, index = Category, Category.cat_name, dictionary.categories
+            still_orphan = ~exists().where(Card.category_id == Category.id)
+        async with get_db_transaction() as session:
+            if not await _lock_for_batch(session, self.lock_timeout_ms):
+                return []
+            # Строки, которые запросы держат FOR KEY SHARE (get_or_create_*), пропускаются;
+            # после FOR UPDATE новые запросы ждут конца этой транзакции.
+            result = await session.execute(
+                select(model.id).where(model.id.in_(ids)).with_for_update(skip_locked=True))
+            ids = result.scalars().all()
+            if not ids:
+                return []
+            result = await session.execute(
+                delete(model)
+                .where(model.id.in_(ids), still_orphan)
+                .returning(model.id, name))
+            removed = result.all()
+        for _, removed_name in removed:
+            index.discard(removed_name)
+        return removed
+
+    async def collect(self) -> CleanupStats:
+        """Один проход сборки мусора.
+
+        Returns:
+            CleanupStats: Количество удаленных строк и длительность прохода
+        """
+        started = time.perf_counter()
+        stats = CleanupStats()
+        for kind in ('tag', 'category'):
+            orphans = await self._orphans(kind)
+            ready = sorted(orphans & self._suspects[kind])
+            removed = set()
+            for pos in range(0, len(ready), self.batch_size):
+                batch = ready[pos:pos + self.batch_size]
+                try:
+                    removed.update(id_ for id_, _ in await self._delete_batch(kind, batch))
+                except DBAPIError as e:
+                    logger.warning('Пропуск пакета %s: %s', kind, e.orig)
+                await asyncio.sleep(0)
+            self._suspects[kind] = orphans - removed
+            setattr(stats, 'tags' if kind == 'tag' else 'categories', len(removed))
+        stats.seconds = time.perf_counter() - started
+        logger.info('Сборка мусора: удалено тэгов %s, категорий %s за %.3f с',
+                    stats.tags, stats.categories, stats.seconds)
+        return stats
+
+
+async def run_periodically(job: Callable[[], Awaitable], interval: float, name: str) -> None:
+    """Запускает job каждые interval секунд до отмены задачи."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await job()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception('Ошибка фоновой задачи %s', name)
+
+
+async def _run(args: argparse.Namespace) -> None:
+    from app.db import dispose_engine
+    try:
+        if args.command == 'check-tags':
+            drifted = await check_tag_snapshots(repair=args.repair, batch_size=args.batch_size)
+            print(f'Карточек с расхождениями: {drifted}')
+        elif args.command == 'reconcile-counters':
+            fixed = await reconcile_counters(batch_size=args.batch_size)
+            print(f'Исправлено пользователей: {fixed}')
+        elif args.command == 'purge':
+            purged = await purge_deleted_cards(retention_days=args.retention_days,
+                                               batch_size=args.batch_size)
+            print(f'Удалено карточек: {purged}')
+        elif args.command == 'gc':
+            collector = OrphanCollector(batch_size=args.batch_size)
+            await collector.collect()
+            await asyncio.sleep(args.grace)
+            stats = await collector.collect()
+            print(f'Удалено тэгов: {stats.tags}, категорий: {stats.categories}')
+    finally:
+        await dispose_engine()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Обслуживание БД')
+    sub = parser.add_subparsers(dest='command', required=True)
+    check = sub.add_parser('check-tags', help='сверить tag_names с card_tag')
+    check.add_argument('--repair', action='store_true')
+    check.add_argument('--batch-size', type=int, default=500)
+    gc = sub.add_parser('gc', help='удалить тэги и категории без карточек')
+    gc.add_argument('--batch-size', type=int, default=100)
+    gc.add_argument('--grace', type=float, default=60,
+                    help='пауза между проходами, с: удаляется то, что было без ссылок в обоих')
+    counters = sub.add_parser('reconcile-counters', help='пересчитать счетчики карточек')
+    counters.add_argument('--batch-size', type=int, default=200)
+    purge = sub.add_parser('purge', help='удалить карточки после срока хранения')
+    purge.add_argument('--retention-days', type=float, default=30)
+    purge.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Начальная схема
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'users',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('username', sa.String(), nullable=False),
+        sa.Column('email', sa.String(), nullable=False),
+        sa.Column('hashed_password', sa.String(), nullable=False),
+        sa.Column('is_user', sa.Boolean(), server_default=sa.text('true'), nullable=False),
+        sa.Column('is_admin', sa.Boolean(), server_default=sa.text('false'), nullable=False),
+    )
+    op.create_index('ix_users_id', 'users', ['id'])
+    op.create_index('ix_users_username', 'users', ['username'], unique=True)
+    op.create_index('ix_users_email', 'users', ['email'], unique=True)
+
+    op.create_table(
+        'category',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('cat_name', sa.String(12), unique=True),
+    )
+    op.create_table(
+        'tag',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('tag_name', sa.String(12), unique=True),
+    )
+    op.create_table(
+        'card_object',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('title', sa.String(15)),
+        sa.Column('subtitle', sa.String(30)),
+        sa.Column('content', sa.Text()),
+        sa.Column('owner_id', sa.Integer(), sa.ForeignKey('users.id')),
+        sa.Column('category_id', sa.Integer(),
+                  sa.ForeignKey('category.id', ondelete='SET NULL'), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True),
+                  server_default=sa.func.now(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_table(
+        'card_tag',
+        sa.Column('card_id', sa.Integer(), sa.ForeignKey('card_object.id', ondelete='CASCADE')),
+        sa.Column('tag_id', sa.Integer(), sa.ForeignKey('tag.id', ondelete='CASCADE')),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('card_tag')
+    op.drop_table('card_object')
+    op.drop_table('tag')
+    op.drop_table('category')
+    op.drop_index('ix_users_email', table_name='users')
+    op.drop_index('ix_users_username', table_name='users')
+    op.drop_index('ix_users_id', table_name='users')
+    op.drop_table('users')
@@ -0,0 +1,79 @@
+"""Сжатое содержание карточек
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+import zlib
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, Sequence[str], None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COMPRESS_THRESHOLD = 2048
+BATCH_SIZE = 500
+
+card = sa.table(
+    'card_object',
+    sa.column('id', sa.Integer),
+    sa.column('content', sa.Text),
+    sa.column('content_z', sa.LargeBinary),
+    sa.column('content_size', sa.Integer),
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('card_object', sa.Column('content_z', sa.LargeBinary(), nullable=True))
+    op.add_column('card_object', sa.Column('content_size', sa.Integer(), nullable=True))
+
+    if context.is_offline_mode():
+        # В режиме --sql строки не прочитать: заполняется только размер.
+        # Большие тексты остаются несжатыми в content (unpack читает оба
+        # варианта) и сжимаются при следующей записи карточки.
+        op.execute(sa.update(card).where(card.c.content.is_not(None))
+                   .values(content_size=sa.func.octet_length(card.c.content)))
+        return
+
+    conn = op.get_bind()
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            sa.select(card.c.id, card.c.content)
+            .where(card.c.id > last_id, card.c.content.is_not(None))
+            .order_by(card.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        for card_id, text in rows:
+            raw = text.encode()
+            values = {'content_size': len(raw)}
+            if len(raw) > COMPRESS_THRESHOLD:
+                values.update(content=None, content_z=zlib.compress(raw, 6))
+            conn.execute(sa.update(card).where(card.c.id == card_id).values(**values))
+        last_id = rows[-1][0]
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if context.is_offline_mode():
+        raise RuntimeError('Откат 0002 распаковывает content_z в Python и требует подключения к БД')
+    conn = op.get_bind()
+    rows = conn.execute(
+        sa.select(card.c.id, card.c.content_z).where(card.c.content_z.is_not(None))
+    ).all()
+    for card_id, compressed in rows:
+        conn.execute(sa.update(card).where(card.c.id == card_id)
+                     .values(content=zlib.decompress(compressed).decode()))
+
+    op.drop_column('card_object', 'content_size')
+    op.drop_column('card_object', 'content_z')
@@ -0,0 +1,44 @@
+"""Копия имен тэгов в карточке
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, Sequence[str], None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('card_object', sa.Column('tag_names', postgresql.ARRAY(sa.String(12)),
+                                           server_default='{}', nullable=False))
+    op.execute("""
+        UPDATE card_object AS c
+        SET tag_names = t.names
+        FROM (
+            SELECT ct.card_id, array_agg(tag.tag_name ORDER BY tag.tag_name) AS names
+            FROM card_tag AS ct
+            JOIN tag ON tag.id = ct.tag_id
+            GROUP BY ct.card_id
+        ) AS t
+        WHERE c.id = t.card_id
+    """)
+    op.create_index('ix_card_object_tag_names', 'card_object', ['tag_names'],
+                    postgresql_using='gin')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_card_object_tag_names', table_name='card_object')
+    op.drop_column('card_object', 'tag_names')
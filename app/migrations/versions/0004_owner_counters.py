@@ -0,0 +1,63 @@
+"""Счетчики карточек пользователя
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, Sequence[str], None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'owner_card_count',
+        sa.Column('owner_id', sa.Integer(), primary_key=True),
+        sa.Column('total', sa.Integer(), server_default=sa.text('0'), nullable=False),
+    )
+    op.create_table(
+        'owner_facet_count',
+        sa.Column('owner_id', sa.Integer(), primary_key=True),
+        sa.Column('kind', sa.String(3), primary_key=True),
+        sa.Column('name', sa.String(12), primary_key=True),
+        sa.Column('count', sa.Integer(), server_default=sa.text('0'), nullable=False),
+    )
+    op.execute("""
+        INSERT INTO owner_card_count (owner_id, total)
+        SELECT owner_id, count(*) FROM card_object
+        WHERE owner_id IS NOT NULL
+        GROUP BY owner_id
+    """)
+    op.execute("""
+        INSERT INTO owner_facet_count (owner_id, kind, name, count)
+        SELECT c.owner_id, 'tag', t.tag_name, count(*)
+        FROM card_object AS c
+        JOIN card_tag AS ct ON ct.card_id = c.id
+        JOIN tag AS t ON t.id = ct.tag_id
+        WHERE c.owner_id IS NOT NULL
+        GROUP BY c.owner_id, t.tag_name
+    """)
+    op.execute("""
+        INSERT INTO owner_facet_count (owner_id, kind, name, count)
+        SELECT c.owner_id, 'cat', cat.cat_name, count(*)
+        FROM card_object AS c
+        JOIN category AS cat ON cat.id = c.category_id
+        WHERE c.owner_id IS NOT NULL
+        GROUP BY c.owner_id, cat.cat_name
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('owner_facet_count')
+    op.drop_table('owner_card_count')
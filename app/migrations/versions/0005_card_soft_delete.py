@@ -0,0 +1,36 @@
+"""Мягкое удаление карточек
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, Sequence[str], None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('card_object', sa.Column('deleted_at', sa.DateTime(timezone=True), nullable=True))
+    op.create_index('ix_card_object_owner_live', 'card_object', ['owner_id', 'id'],
+                    postgresql_where=sa.text('deleted_at IS NULL'),
+                    sqlite_where=sa.text('deleted_at IS NULL'))
+    op.create_index('ix_card_object_deleted_at', 'card_object', ['deleted_at'],
+                    postgresql_where=sa.text('deleted_at IS NOT NULL'),
+                    sqlite_where=sa.text('deleted_at IS NOT NULL'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_card_object_deleted_at', table_name='card_object')
+    op.drop_index('ix_card_object_owner_live', table_name='card_object')
+    op.drop_column('card_object', 'deleted_at')
@@ -0,0 +1,275 @@
+import asyncio
+import cProfile
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import secrets
+import time
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from functools import lru_cache, wraps
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from typing import Optional
+
+from app.service import settings
+
+"""
+Профилирование отдельных запросов cProfile по заголовку администратора
+или по выборке. Профили пишутся в кольцевой буфер файлов на диске.
+Когда PROFILING_ENABLED выключен, middleware и таймеры не устанавливаются.
+
+Разбивка по категориям - время по часам (wall), а не CPU: таймеры
+пишут в накопитель запроса из contextvar, поэтому ожидание SQL
+учитывается, а параллельные запросы в тот же накопитель не попадают.
+"""
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'x-profile'
+PROFILE_ID_HEADER = 'x-profile-id'
+
+CATEGORIES = ('sql', 'serialization', 'templates', 'jwt', 'bcrypt')
+
+_NAME_RE = re.compile(r'^[0-9T]+-[0-9a-f]{8}$')
+
+# Накопитель профилируемого запроса: категория -> секунды, иначе None.
+_timings: ContextVar[Optional[dict[str, float]]] = ContextVar('profiling_timings', default=None)
+_SQL_STARTED = 'profiling_sql_started'
+_instrumented = False
+
+
+@contextmanager
+def timed(category: str):
+    """Добавляет время блока к категории, если запрос профилируется."""
+    totals = _timings.get()
+    if totals is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        totals[category] = totals.get(category, 0.0) + time.perf_counter() - started
+
+
+def categorize(totals: dict[str, float], wall: float) -> dict[str, float]:
+    """Переводит накопитель в мс; остаток времени запроса - в 'other'.
+
+    Args:
+        totals: Категория -> секунды
+        wall: Время запроса, с
+    Returns:
+        dict: Категория -> мс
+    """
+    result = {name: totals.get(name, 0.0) for name in CATEGORIES}
+    result['other'] = max(wall - sum(result.values()), 0.0)
+    return {name: round(seconds * 1000, 3) for name, seconds in result.items()}
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _timings.get() is not None:
+        conn.info.setdefault(_SQL_STARTED, []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    totals = _timings.get()
+    started = conn.info.get(_SQL_STARTED)
+    if totals is not None and started:
+        totals['sql'] = totals.get('sql', 0.0) + time.perf_counter() - started.pop()
+
+
+def _timed_async(category: str, func):
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        with timed(category):
+            return await func(*args, **kwargs)
+    return wrapper
+
+
+def _timed_sync(category: str, func):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with timed(category):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def instrument() -> None:
+    """Подключает таймеры SQL и сериализации ответа (один раз на процесс).
+
+    SQL - события курсора всех движков, то есть время до ответа БД.
+    Сериализация - проверка response_model в FastAPI и JSONResponse.render.
+    Шаблоны, JWT и bcrypt замеряются через timed() в месте вызова.
+    """
+    global _instrumented
+    if _instrumented:
+        return
+    import fastapi.routing
+    from starlette.responses import JSONResponse
+
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    fastapi.routing.serialize_response = _timed_async('serialization', fastapi.routing.serialize_response)
+    JSONResponse.render = _timed_sync('serialization', JSONResponse.render)
+    _instrumented = True
+
+
+class ProfileStore:
+    """Кольцевой буфер профилей: <id>.prof (pstats) и <id>.json (сводка).
+
+    При превышении max_files удаляются самые старые профили.
+    """
+
+    def __init__(self, directory: str, max_files: int = 50):
+        self.directory = directory
+        self.max_files = max_files
+
+    def _path(self, profile_id: str, ext: str) -> str:
+        if not _NAME_RE.match(profile_id):
+            raise ValueError(f'Недопустимый id профиля: {profile_id!r}')
+        return os.path.join(self.directory, f'{profile_id}.{ext}')
+
+    @staticmethod
+    def new_id() -> str:
+        return f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')}-{secrets.token_hex(4)}"
+
+    def save(self, profile_id: str, profiler: cProfile.Profile, meta: dict) -> dict:
+        """Сохраняет профиль и сводку (meta, включая категории).
+
+        Returns:
+            dict: Сводка, записанная в <id>.json
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        stats = pstats.Stats(profiler)
+        summary = {'id': profile_id, **meta}
+        stats.dump_stats(self._path(profile_id, 'prof'))
+        with open(self._path(profile_id, 'json'), 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False)
+        self._trim()
+        return summary
+
+    def _ids(self) -> list[str]:
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(name[:-5] for name in names if name.endswith('.json') and _NAME_RE.match(name[:-5]))
+
+    def _trim(self) -> None:
+        ids = self._ids()
+        for profile_id in ids[:max(len(ids) - self.max_files, 0)]:
+            for ext in ('prof', 'json'):
+                try:
+                    os.remove(self._path(profile_id, ext))
+                except FileNotFoundError:
+                    pass
+
+    def list(self) -> list[dict]:
+        """Сводки сохраненных профилей, новые первыми."""
+        result = []
+        for profile_id in reversed(self._ids()):
+            try:
+                with open(self._path(profile_id, 'json'), encoding='utf-8') as f:
+                    result.append(json.load(f))
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+        return result
+
+    def prof_path(self, profile_id: str) -> Optional[str]:
+        """Путь к файлу pstats или None, если профиля нет (или id недопустим)."""
+        try:
+            path = self._path(profile_id, 'prof')
+        except ValueError:
+            return None
+        return path if os.path.exists(path) else None
+
+
+@lru_cache
+def get_profile_store() -> ProfileStore:
+    return ProfileStore(settings.PROFILING_DIR, settings.PROFILING_MAX_FILES)
+
+
+class ProfilingMiddleware:
+    """ASGI middleware: профилирует запрос целиком при заголовке
+    X-Profile с токеном администратора или с вероятностью sample_rate.
+
+    Категории считаются по часам только для этого запроса (см. timed).
+    Файл cProfile снимает весь поток, поэтому в него попадают и другие
+    запросы, выполнявшиеся в цикле событий одновременно; одновременно
+    профилируется не больше одного запроса.
+    """
+
+    def __init__(self, app: ASGIApp, store: ProfileStore, token: str = '', sample_rate: float = 0.0,
+                 path_prefix: str = '/'):
+        self.app = app
+        self.store = store
+        self.token = token
+        self.sample_rate = sample_rate
+        self.path_prefix = path_prefix
+        self._active = False
+
+    def _requested(self, scope: Scope) -> bool:
+        header = Headers(scope=scope).get(PROFILE_HEADER)
+        if header is not None and self.token:
+            return secrets.compare_digest(header.encode(), self.token.encode())
+        return False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http' or self._active or not scope['path'].startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+        requested = self._requested(scope)
+        if not requested and not (self.sample_rate and random.random() < self.sample_rate):
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = self.store.new_id()
+        status = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                if requested:
+                    MutableHeaders(scope=message).append(PROFILE_ID_HEADER, profile_id)
+            await send(message)
+
+        self._active = True
+        totals: dict[str, float] = {}
+        token = _timings.set(totals)
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.disable()
+            wall = time.perf_counter() - started
+            _timings.reset(token)
+            self._active = False
+            meta = {
+                'method': scope['method'],
+                'path': scope['path'],
+                'query': scope.get('query_string', b'').decode('latin-1'),
+                'status': status,
+                'wall_ms': round(wall * 1000, 3),
+                'trigger': 'header' if requested else 'sample',
+                'created_at': datetime.now(timezone.utc).isoformat(),
+                'categories': categorize(totals, wall),
+            }
+            try:
+                summary = await asyncio.to_thread(self.store.save, profile_id, profiler, meta)
+                logger.info('Профиль %s %s: %s', meta['path'], profile_id, summary['categories'])
+            except OSError as e:
+                logger.warning('Не удалось сохранить профиль %s: %s', profile_id, e)
@@ -0,0 +1,260 @@
+import asyncio
+import re
+import time
+
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict
+
+from typing import Awaitable, Callable, Iterable, Optional
+
+"""
+Поиск по триграммам: инвертированный индекс в памяти процесса на каждого
+владельца. Находит подстроки и слова с опечатками, ранжирует по доле
+совпавших триграмм запроса.
+"""
+
+_WORD_RE = re.compile(r'\w+')
+
+DocumentLoader = Callable[[int], Awaitable[Iterable[tuple[int, str]]]]
+
+
+def trigrams(text: str) -> set[str]:
+    """Триграммы текста в стиле pg_trgm: слова в нижнем регистре,
+    дополненные двумя пробелами слева и одним справа."""
+    result = set()
+    for word in _WORD_RE.findall(text.lower()):
+        padded = f'  {word} '
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+def inner_trigrams(text: str) -> set[str]:
+    """Триграммы внутри слов, без дополнения пробелами.
+
+    Есть в триграммах любого текста, содержащего text как подстроку.
+    """
+    result = set()
+    for word in _WORD_RE.findall(text.lower()):
+        result.update(word[i:i + 3] for i in range(len(word) - 2))
+    return result
+
+
+def document_text(title: Optional[str], subtitle: Optional[str], content: Optional[str],
+                  cat_name: Optional[str], tag_names: Iterable[str] = ()) -> str:
+    """Текст для индекса: заголовки, содержание, категория и тэги."""
+    parts = [title, subtitle, content, cat_name, *(tag_names or ())]
+    return ' '.join(p for p in parts if p)
+
+
+def card_text(card) -> str:
+    """Текст карточки для индекса (ORM-объект с загруженными content и category)."""
+    return document_text(card.title, card.subtitle, card.content,
+                         card.category.cat_name if card.category is not None else None,
+                         card.tag_names)
+
+
+class TrigramIndex:
+    """Индекс карточек одного владельца.
+
+    Списки вхождений хранятся отсортированными массивами array('I').
+    """
+
+    def __init__(self):
+        self._postings: dict[str, array] = {}
+        self._docs: dict[int, tuple[str, ...]] = {}
+        # Версия данных владельца, по которой построен индекс (None - неизвестна).
+        self.version = None
+        self.built_at = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    @classmethod
+    def build(cls, docs: Iterable[tuple[int, str]]) -> 'TrigramIndex':
+        """Строит индекс целиком: списки вхождений сортируются один раз."""
+        index = cls()
+        postings: dict[str, list[int]] = defaultdict(list)
+        for card_id, text in docs:
+            grams = tuple(trigrams(text))
+            index._docs[card_id] = grams
+            for gram in grams:
+                postings[gram].append(card_id)
+        index._postings = {gram: array('I', sorted(ids)) for gram, ids in postings.items()}
+        return index
+
+    def add(self, card_id: int, text: str) -> None:
+        """Добавляет или переиндексирует карточку."""
+        if card_id in self._docs:
+            self.remove(card_id)
+        grams = tuple(trigrams(text))
+        self._docs[card_id] = grams
+        for gram in grams:
+            posting = self._postings.get(gram)
+            if posting is None:
+                self._postings[gram] = array('I', (card_id,))
+            else:
+                posting.insert(bisect_left(posting, card_id), card_id)
+
+    def remove(self, card_id: int) -> None:
+        for gram in self._docs.pop(card_id, ()):
+            posting = self._postings[gram]
+            pos = bisect_left(posting, card_id)
+            if pos < len(posting) and posting[pos] == card_id:
+                del posting[pos]
+            if not posting:
+                del self._postings[gram]
+
+    def containing(self, grams: Iterable[str]) -> set[int]:
+        """id карточек, в тексте которых есть все триграммы grams."""
+        result = None
+        for gram in sorted(grams, key=lambda gram: len(self._postings.get(gram, ()))):
+            ids = set(self._postings.get(gram, ()))
+            result = ids if result is None else result & ids
+            if not result:
+                return set()
+        return result or set()
+
+    def search(self, q: str, threshold: float = 0.3, limit: int = 50) -> list[tuple[int, float]]:
+        """Ищет карточки, похожие на запрос.
+
+        Args:
+            q: Текст запроса
+            threshold: Минимальная доля совпавших триграмм запроса
+            limit: Максимум результатов
+        Returns:
+            list: Пары (id карточки, сходство) по убыванию сходства
+        """
+        grams = trigrams(q)
+        if not grams:
+            return []
+        hits: dict[int, int] = defaultdict(int)
+        for gram in grams:
+            for card_id in self._postings.get(gram, ()):
+                hits[card_id] += 1
+
+        scored = []
+        for card_id, count in hits.items():
+            score = count / len(grams)
+            if score >= threshold:
+                jaccard = count / (len(grams) + len(self._docs[card_id]) - count)
+                scored.append((score, jaccard, card_id))
+        scored.sort(reverse=True)
+        return [(card_id, score) for score, _, card_id in scored[:limit]]
+
+
+class SearchEngine:
+    """Индексы владельцев с вытеснением давно не искавших (LRU).
+
+    Индекс строится при первом поиске владельца в отдельном потоке. Перед
+    поиском вызывающий передает версию данных владельца из БД: если она
+    не совпадает с версией индекса (запись в другом воркере), индекс
+    перестраивается. Запись этого процесса передает версию, полученную в
+    своей транзакции: индекс обновляется на месте, только если это
+    следующая версия после его собственной, иначе (пропущены чужие записи
+    или версия неизвестна) индекс сбрасывается. ttl ограничивает жизнь
+    индекса на случай записей, не изменивших версию.
+    """
+
+    def __init__(self, max_users: int = 1000, ttl: float = 300):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._indexes: OrderedDict[int, TrigramIndex] = OrderedDict()
+        self._building: dict[int, bool] = {}
+
+    def _touch(self, owner_id: int, version=None) -> Optional[TrigramIndex]:
+        """Индекс для правки на месте после записи с версией version или None.
+
+        Индекс без пропущенных записей (его версия на единицу меньше)
+        получает новую версию, любой другой сбрасывается.
+        """
+        if owner_id in self._building:
+            self._building[owner_id] = True
+        index = self._indexes.get(owner_id)
+        if index is None:
+            return None
+        if version is None or index.version is None or index.version + 1 != version:
+            del self._indexes[owner_id]
+            return None
+        index.version = version
+        return index
+
+    def _current(self, owner_id: int, version) -> Optional[TrigramIndex]:
+        index = self._indexes.get(owner_id)
+        if index is None:
+            return None
+        if self.ttl and time.monotonic() - index.built_at > self.ttl:
+            return None
+        if version is not None and index.version != version:
+            return None
+        return index
+
+    async def get_index(self, owner_id: int, loader: DocumentLoader, version=None) -> TrigramIndex:
+        """Индекс владельца, перестроенный, если устарел.
+
+        Args:
+            owner_id: id владельца
+            loader: Загрузчик пар (id карточки, текст)
+            version: Текущая версия данных владельца в БД
+        """
+        index = self._current(owner_id, version)
+        if index is not None:
+            self._indexes.move_to_end(owner_id)
+            return index
+        self._indexes.pop(owner_id, None)
+
+        self._building[owner_id] = False
+        try:
+            docs = await loader(owner_id)
+            index = await asyncio.to_thread(TrigramIndex.build, docs)
+            index.version = version
+        finally:
+            changed = self._building.pop(owner_id, True)
+        if not changed:
+            self._indexes[owner_id] = index
+            while len(self._indexes) > self.max_users:
+                self._indexes.popitem(last=False)
+        return index
+
+    async def search(self, owner_id: int, q: str, loader: DocumentLoader, version=None,
+                     threshold: float = 0.3, limit: int = 50) -> list[tuple[int, float]]:
+        index = await self.get_index(owner_id, loader, version)
+        return index.search(q, threshold, limit)
+
+    async def candidates(self, owner_id: int, q: str, loader: DocumentLoader,
+                         version=None) -> Optional[set[int]]:
+        """Карточки, которые могут содержать q как подстроку (предфильтр для ILIKE).
+
+        Returns:
+            set | None: id карточек или None, если в q нет слова из 3+ символов
+        """
+        grams = inner_trigrams(q)
+        if not grams:
+            return None
+        index = await self.get_index(owner_id, loader, version)
+        return index.containing(grams)
+
+    def is_indexed(self, owner_id: int) -> bool:
+        return owner_id in self._indexes or owner_id in self._building
+
+    def card_saved(self, owner_id: int, card_id: int, text: str, version: Optional[int] = None) -> None:
+        index = self._touch(owner_id, version)
+        if index is not None:
+            index.add(card_id, text)
+
+    def card_deleted(self, owner_id: int, card_id: int, version: Optional[int] = None) -> None:
+        index = self._touch(owner_id, version)
+        if index is not None:
+            index.remove(card_id)
+
+    def invalidate(self, owner_id: int) -> None:
+        """Сбрасывает индекс владельца, если он строится или уже построен."""
+        self._touch(owner_id)
+        self._indexes.pop(owner_id, None)
+
+    def drop(self, owner_id: Optional[int] = None) -> None:
+        """Сбрасывает индекс владельца или все индексы."""
+        if owner_id is None:
+            self._indexes.clear()
+        else:
+            self._indexes.pop(owner_id, None)
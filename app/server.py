@@ -0,0 +1,64 @@
+import argparse
+import importlib.util
+import logging
+import os
+
+import uvicorn
+
+from app.assets import BUILD_DIR, STATIC_DIR, build_assets
+
+"""
+Запуск в production: несколько воркеров uvicorn.
+
+    python -m app.server [--workers N] [--max-requests 10000]
+
+Каждый воркер создает собственный движок БД при первом запросе
+(app.db.get_engine) и закрывает его в lifespan при остановке.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def _available(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Production-запуск Mini Hub')
+    parser.add_argument('--host', default=os.getenv('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', 8000)))
+    parser.add_argument('--workers', type=int,
+                        default=int(os.getenv('WEB_WORKERS', os.cpu_count() or 1)),
+                        help='число процессов, по умолчанию по числу ядер')
+    parser.add_argument('--max-requests', type=int,
+                        default=int(os.getenv('WEB_MAX_REQUESTS', 10000)),
+                        help='перезапуск воркера после N запросов, 0 - без ограничения')
+    parser.add_argument('--graceful-timeout', type=int,
+                        default=int(os.getenv('WEB_GRACEFUL_TIMEOUT', 30)))
+    parser.add_argument('--access-log', action='store_true')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    # Статика собирается один раз до запуска воркеров, они читают манифест.
+    build_assets(STATIC_DIR, BUILD_DIR)
+
+    loop = 'uvloop' if _available('uvloop') else 'asyncio'
+    http = 'httptools' if _available('httptools') else 'h11'
+    logger.info('Запуск %s воркеров, loop=%s, http=%s', args.workers, loop, http)
+
+    uvicorn.run(
+        'app.main:app',
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        loop=loop,
+        http=http,
+        limit_max_requests=args.max_requests or None,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        access_log=args.access_log,
+        proxy_headers=True,
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,15 @@
 import os
 
+from functools import lru_cache
+
+from typing import Iterable, Literal
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 from app.api.notes import Category, Tag
 
 from sqlalchemy import select
 
-from passlib.context import CryptContext
-
-from jose import JWTError
-
-from fastapi import Response, Request, Depends
-
-pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 class Settings(BaseSettings):
@@ -24,17 +21,80 @@ class Settings(BaseSettings):
     DB_PASSWORD: str
     SECRET_KEY: str
 
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+
+    LOG_LEVEL: str = 'INFO'
+    LOG_LEVELS: dict[str, str] = {}
+    LOG_SAMPLE_RATE: float = 0.1
+    LOG_QUEUE_SIZE: int = 10000
+
+    # create_all - для новой БД (затем она помечается head); существующую БД
+    # create_all не меняет, ее схема обновляется только через alembic, см. prepare_db.
+    STARTUP_MODE: Literal['create_all', 'migrations'] = 'create_all'
+
+    SEARCH_ENGINE: Literal['ilike', 'trigram'] = 'ilike'
+    SEARCH_INDEX_MAX_USERS: int = 1000
+    SEARCH_INDEX_TTL: float = 300
+    SEARCH_TRGM_THRESHOLD: float = 0.3
+
+    AUTH_TOKEN_CACHE_SIZE: int = 10000
+
+    DICTIONARY_REFRESH_INTERVAL: float = 60
+
+    GC_INTERVAL: float = 600
+    GC_BATCH_SIZE: int = 100
+    GC_LOCK_TIMEOUT_MS: int = 200
+
+    COUNTERS_RECONCILE_INTERVAL: float = 0
+
+    FRAGMENT_CACHE_TTL: float = 30
+    FRAGMENT_CACHE_SIZE: int = 1000
+
+    WRITE_BEHIND_ENABLED: bool = False
+    WRITE_BEHIND_WINDOW: float = 1.0
+    WRITE_BEHIND_DURABILITY: Literal['async', 'sync'] = 'sync'
+    WRITE_BEHIND_MAX_PENDING: int = 1000
+
+    CARD_RETENTION_DAYS: float = 30
+    PURGE_INTERVAL: float = 3600
+    PURGE_BATCH_SIZE: int = 500
+
+    PROFILING_ENABLED: bool = False
+    PROFILING_TOKEN: str = ''
+    PROFILING_SAMPLE_RATE: float = 0.0
+    PROFILING_PATH_PREFIX: str = '/action/'
+    PROFILING_DIR: str = 'profiles'
+    PROFILING_MAX_FILES: int = 50
+
     model_config = SettingsConfigDict(
             env_file=os.path.join(BASE_DIR, ".env"),
             env_file_encoding="utf-8"
             )
 
-settings = Settings()
+
+@lru_cache
+def get_settings() -> Settings:
+    return Settings()
+
+
+@lru_cache
+def get_pwd_context():
+    """CryptContext создается при первом хэшировании, а не при импорте."""
+    from passlib.context import CryptContext
+    return CryptContext(schemes=['bcrypt'], deprecated='auto')
+
+
+# Настройки нужны при импорте роутеров, auth и DAO, поэтому создаются сразу;
+# отложено только дорогое создание CryptContext.
+settings = get_settings()
+
 
 class Service:
     @staticmethod
     async def get_or_create_category(session, name: str) -> Category:
-        stmt = select(Category).where(Category.cat_name == name)
+        # FOR KEY SHARE: сборщик мусора не удалит строку до конца транзакции.
+        stmt = select(Category).where(Category.cat_name == name).with_for_update(read=True, key_share=True)
         result = await session.execute(stmt)
         category = result.scalar_one_or_none()
 
@@ -45,7 +105,7 @@ class Service:
 
     @staticmethod
     async def get_or_create_tag(session, name: str) -> Tag:
-        stmt = select(Tag).where(Tag.tag_name == name)
+        stmt = select(Tag).where(Tag.tag_name == name).with_for_update(read=True, key_share=True)
         result = await session.execute(stmt)
         tag = result.scalar_one_or_none()
         if not tag:
@@ -53,13 +113,32 @@ class Service:
             session.add(tag)
         return tag
 
+    @staticmethod
+    async def get_or_create_tags(session, names: Iterable[str]) -> list[Tag]:
+        """Возвращает тэги по списку имен одним запросом, создавая недостающие.
+
+        Найденные строки блокируются FOR KEY SHARE до конца транзакции,
+        чтобы сборщик мусора не удалил их до вставки в card_tag.
+        """
+        names = list(dict.fromkeys(names))
+        if not names:
+            return []
+        stmt = select(Tag).where(Tag.tag_name.in_(names)).with_for_update(read=True, key_share=True)
+        result = await session.execute(stmt)
+        found = {tag.tag_name: tag for tag in result.scalars()}
+        for name in names:
+            if name not in found:
+                found[name] = Tag(tag_name=name)
+                session.add(found[name])
+        return [found[name] for name in names]
+
     @staticmethod
     async def hash_password(password: str) -> str:
-        return pwd_context.hash(password)
+        return get_pwd_context().hash(password)
 
     @staticmethod
     async def verify_method(plain_password: str, hashed_password: str) -> bool:
-        return pwd_context.verify(plain_password, hashed_password)
+        return get_pwd_context().verify(plain_password, hashed_password)
 
 
 
@@ -0,0 +1,107 @@
+import argparse
+import asyncio
+import subprocess
+import sys
+import time
+
+from collections import defaultdict
+
+"""
+Профилировщик запуска приложения.
+
+    python -m app.startup_profile [--top 20] [--path /openapi.json] [--no-lifespan]
+
+Показывает время импорта по модулям (через -X importtime в отдельном
+процессе) и время до первого обработанного запроса в текущем процессе.
+"""
+
+
+def import_times(target: str = 'app.main', depth: int = 2) -> dict[str, float]:
+    """Время импорта модулей в мс, сгруппированное по первым depth частям имени.
+
+    Args:
+        target: Импортируемый модуль
+        depth: Глубина группировки имени модуля
+    Returns:
+        dict: {модуль: собственное время импорта, мс}
+    """
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {target}'],
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+
+    totals: dict[str, float] = defaultdict(float)
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        module = '.'.join(name.strip().split('.')[:depth])
+        totals[module] += int(self_us) / 1000
+    return dict(totals)
+
+
+async def _first_request(app, path: str) -> int:
+    """Отправляет в приложение один GET-запрос напрямую через ASGI."""
+    status = 0
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+        'query_string': b'', 'root_path': '', 'headers': [(b'host', b'localhost')],
+        'client': ('127.0.0.1', 0), 'server': ('localhost', 8000),
+    }
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    await app(scope, receive, send)
+    return status
+
+
+async def time_to_first_request(path: str, lifespan: bool) -> dict[str, float]:
+    """Замеряет этапы запуска: импорт, lifespan и первый запрос, мс."""
+    started = time.perf_counter()
+    from app.main import app
+    imported = time.perf_counter()
+
+    timings = {'import app.main': (imported - started) * 1000}
+    if lifespan:
+        async with app.router.lifespan_context(app):
+            ready = time.perf_counter()
+            timings['lifespan startup'] = (ready - imported) * 1000
+            await _first_request(app, path)
+    else:
+        ready = time.perf_counter()
+        await _first_request(app, path)
+    done = time.perf_counter()
+    timings[f'first request {path}'] = (done - ready) * 1000
+    timings['time to first request'] = (done - started) * 1000
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Профиль запуска приложения')
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--depth', type=int, default=2)
+    parser.add_argument('--path', default='/openapi.json')
+    parser.add_argument('--no-lifespan', action='store_true',
+                        help='не выполнять lifespan (без подключения к БД)')
+    args = parser.parse_args()
+
+    totals = import_times(depth=args.depth)
+    print(f'{"модуль":<40} {"импорт, мс":>12}')
+    for module, ms in sorted(totals.items(), key=lambda i: i[1], reverse=True)[:args.top]:
+        print(f'{module:<40} {ms:>12.1f}')
+    print(f'{"всего":<40} {sum(totals.values()):>12.1f}\n')
+
+    timings = asyncio.run(time_to_first_request(args.path, not args.no_lifespan))
+    for stage, ms in timings.items():
+        print(f'{stage:<40} {ms:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
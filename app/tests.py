@@ -1,17 +1,44 @@
 import pytest_asyncio
 import asyncio
+import json
+import logging
 import os
 import pytest
+import queue
+import sys
+import time
 from sqlalchemy.pool import NullPool
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
-from sqlalchemy import select, insert
+from sqlalchemy import create_engine, inspect, select, insert, update, delete, text
+from app import DAO
 from app.DAO import CardDAO, UserDAO
 from app.base import Base
-from app.api.notes import Card, Category, User
+from app.db import ALEMBIC_INI, _create_all
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from app.api.notes import Card, Category, Tag, User, OwnerCardCount, tag_table
 from app.service import Service
+from app.logs import JsonFormatter, NonBlockingQueueHandler, SamplingFilter
+from app import dictionary
+from app.dictionary import NameIndex
+from app.search import SearchEngine, TrigramIndex
+from app.auth import CachedAuthX, config as auth_config
+from authx import RequestToken
+from authx.exceptions import CSRFError, JWTDecodeError
+from app.content import pack, unpack, iter_bytes
+from app.api.template import FragmentCache, templates
+from app.assets import build_assets, asset_url, load_manifest
+from app.writebehind import WriteBehindBuffer
+from app.profiling import ProfileStore, ProfilingMiddleware, instrument, timed
+from app.counters import lock_owners
+from app.maintenance import check_tag_snapshots, OrphanCollector, reconcile_counters, purge_deleted_cards
 from contextlib import asynccontextmanager
-from app.api.schemas import CardContent, CardMeta, UserCreate
+from datetime import datetime, timedelta, timezone
+from app.api.schemas import CardContent, CardMeta, CardResponse, UserCreate
 from fastapi.security import OAuth2PasswordRequestForm
+from starlette.requests import Request
+from app.api.infobase import logout
 
 
 os.environ['DATABASE_URL'] = 'sqlite+aiosqlite:///:memory:'
@@ -120,8 +147,26 @@ class TestCard:
                                                  data=CardContent(title='string', subtitle='string', content='string'),
                                                  meta=CardMeta(cat='string', tag=['string', 'string1']))
 
-        assert isinstance(result, bool)
-        assert result == True
+        assert result['title'] == 'string'
+        assert result['content_size'] == len('string')
+        assert result['category']['cat_name'] == 'string'
+        assert result['tag_names'] == ['string', 'string1']
+
+    @pytest.mark.asyncio
+    async def test_update_card_set_based_tags(self, sample_card, func_async_session, monkeypatch):
+        monkeypatch.setattr('app.DAO.get_db_transaction', lambda: fake_get_db_transaction(func_async_session))
+        await CardDAO.update_card_in_bd(card_id=1, owner_id=1, meta=CardMeta(tag=['a', 'b']))
+
+        result = await CardDAO.update_card_in_bd(card_id=1, owner_id=1, data=CardContent(subtitle='new'),
+                                                 meta=CardMeta(tag=['b', 'c']))
+        missing = await CardDAO.update_card_in_bd(card_id=99, owner_id=1, data=CardContent(title='x'))
+
+        assert result['subtitle'] == 'new'
+        assert result['tag_names'] == ['b', 'c']
+        assert missing is None
+        linked = await func_async_session.execute(
+            select(Tag.tag_name).join(tag_table, tag_table.c.tag_id == Tag.id).where(tag_table.c.card_id == 1))
+        assert sorted(linked.scalars()) == ['b', 'c']
 
     @pytest.mark.asyncio
     async def test_delete_card_from_bd(self, sample_card, func_async_session, monkeypatch):
@@ -155,3 +200,560 @@ class TestCard:
         result = await UserDAO.login_user_in_db(OAuth2PasswordRequestForm(username='string', password='string', scope=''))
 
         assert isinstance(result, dict)
+
+
+class TestLogs:
+    def test_json_formatter(self):
+        record = logging.makeLogRecord({'name': 'app.DAO', 'levelno': logging.INFO, 'levelname': 'INFO',
+                                        'msg': 'Запись с %s создана', 'args': (1,)})
+        result = json.loads(JsonFormatter().format(record))
+
+        assert result['msg'] == 'Запись с 1 создана'
+        assert result['logger'] == 'app.DAO'
+
+    def test_queue_handler_prepare(self):
+        items = ['a']
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            record = logging.makeLogRecord({'name': 'app.DAO', 'levelno': logging.ERROR, 'levelname': 'ERROR',
+                                            'msg': 'Список %s', 'args': (items,), 'exc_info': sys.exc_info()})
+        prepared = NonBlockingQueueHandler(queue.Queue()).prepare(record)
+        items.append('b')
+        result = json.loads(JsonFormatter().format(prepared))
+
+        assert (prepared.args, prepared.exc_info, prepared.exc_text) == (None, None, None)
+        assert result['msg'] == "Список ['a']"
+        assert 'ValueError: boom' in result['exc']
+
+    def test_sampling_filter(self):
+        sql = logging.makeLogRecord({'name': 'sqlalchemy.engine.Engine', 'levelno': logging.INFO})
+        info = logging.makeLogRecord({'name': 'app.DAO', 'levelno': logging.INFO})
+
+        assert SamplingFilter(0).filter(sql) is False
+        assert SamplingFilter(0).filter(info) is True
+
+
+class TestDictionary:
+    def test_complete(self):
+        index = NameIndex()
+        index.load([(1, 'python'), (2, 'Pytest'), (3, 'rust')])
+        index.add(4, 'pydantic')
+
+        assert index.complete('py') == ['pydantic', 'Pytest', 'python']
+        assert index.complete('py', limit=1) == ['pydantic']
+        assert index.get_name(3) == 'rust'
+
+    @pytest.mark.asyncio
+    async def test_rolled_back_names_not_added(self, func_async_session, monkeypatch):
+        monkeypatch.setattr('app.dictionary.tags', NameIndex())
+        func_async_session.add(Tag(tag_name='ghost'))
+        await func_async_session.flush()
+        await func_async_session.rollback()
+
+        assert dictionary.tags.complete('gh') == []
+
+        func_async_session.add(Tag(tag_name='ghost'))
+        await func_async_session.commit()
+        assert dictionary.tags.complete('gh') == ['ghost']
+
+    def test_discard(self):
+        index = NameIndex()
+        index.load([(1, 'python'), (2, 'rust')])
+        index.discard('python')
+
+        assert index.complete('p') == []
+        assert index.get_name(1) is None
+
+
+class TestSearch:
+    def test_trigram_index(self):
+        index = TrigramIndex()
+        index.add(1, 'python asyncio')
+        index.add(2, 'rust tokio')
+
+        assert [card_id for card_id, _ in index.search('pyhton')] == [1]
+        assert [card_id for card_id, _ in index.search('synci')] == [1]
+
+        index.remove(1)
+        assert index.search('python') == []
+
+    @pytest.mark.asyncio
+    async def test_search_cards_by_trigrams(self, func_async_session, sample_card, monkeypatch):
+        monkeypatch.setattr('app.DAO.get_db_session', lambda: fake_get_db_session(func_async_session))
+        monkeypatch.setattr('app.DAO.settings.SEARCH_ENGINE', 'trigram')
+        monkeypatch.setattr('app.DAO.search_engine', SearchEngine())
+
+        result = await CardDAO.search_cards_in_bd('Tset Card', 1)
+
+        assert [card.id for card in result] == [1]
+
+
+    @pytest.mark.asyncio
+    async def test_index_rebuilt_on_foreign_write(self):
+        docs = [(1, 'python asyncio')]
+
+        async def loader(owner_id):
+            return list(docs)
+
+        engine = SearchEngine()
+        assert await engine.search(1, 'rust', loader, version=1) == []
+
+        docs.append((2, 'rust tokio'))  # запись в другом воркере
+        assert await engine.search(1, 'rust', loader, version=1) == []
+        assert [card_id for card_id, _ in await engine.search(1, 'rust', loader, version=2)] == [2]
+
+        docs.append((3, 'rust actix'))
+        engine.card_saved(1, 3, 'rust actix', version=3)  # запись в этом процессе - без перестройки
+        docs.append((4, 'rust axum'))
+        ranked = await engine.search(1, 'actix', loader, version=3)
+        assert [card_id for card_id, _ in ranked] == [3]
+
+    @pytest.mark.asyncio
+    async def test_local_write_after_foreign_write_rebuilds(self):
+        docs = [(1, 'python asyncio')]
+
+        async def loader(owner_id):
+            return list(docs)
+
+        engine = SearchEngine()
+        await engine.search(1, 'rust', loader, version=1)
+        docs.append((2, 'rust actix'))
+        engine.card_saved(1, 2, 'rust actix', version=2)
+        docs.append((3, 'rust tokio'))  # другой воркер, версия 3
+        docs.append((4, 'go gin'))
+        engine.card_saved(1, 4, 'go gin', version=4)  # версия 3 пропущена
+
+        ranked = await engine.search(1, 'tokio', loader, version=4)
+        assert [card_id for card_id, _ in ranked] == [3]
+
+
+class TestAuth:
+    def test_verified_token_cache(self):
+        cached = CachedAuthX(config=auth_config, cache_size=10)
+        token = cached.create_access_token(uid='1')
+        csrf = cached._decode_token(token).csrf
+        request_token = RequestToken(token=token, csrf=csrf, location='cookies')
+
+        first = cached.verify_token(request_token)
+        assert cached.verify_token(request_token) is first
+
+        with pytest.raises(CSRFError):
+            cached.verify_token(RequestToken(token=token, csrf='other', location='cookies'))
+
+        cached.invalidate_token(token)
+        assert cached.verify_token(request_token) is not first
+
+    def test_cached_token_nbf_checked(self):
+        cached = CachedAuthX(config=auth_config, cache_size=10)
+        token = cached.create_access_token(uid='1')
+        request_token = RequestToken(token=token, csrf=cached._decode_token(token).csrf, location='cookies')
+        payload = cached.verify_token(request_token)
+
+        payload.nbf = time.time() + 60
+        with pytest.raises(JWTDecodeError):
+            cached.verify_token(request_token)
+
+    @pytest.mark.asyncio
+    async def test_logout_drops_cached_token(self, monkeypatch):
+        cached = CachedAuthX(config=auth_config, cache_size=10)
+        monkeypatch.setattr('app.api.infobase.auth', cached)
+        token = cached.create_access_token(uid='1')
+        cached.verify_token(RequestToken(token=token, csrf=cached._decode_token(token).csrf, location='cookies'))
+        request = Request({'type': 'http', 'method': 'POST', 'path': '/logout/',
+                           'headers': [(b'cookie', f'access_token_cookie={token}'.encode())]})
+
+        response = await logout(request)
+
+        assert len(cached._token_cache) == 0
+        assert 'access_token_cookie=""' in response.headers['set-cookie']
+
+
+class TestContent:
+    def test_pack_large_content(self):
+        text = 'строка ' * 1000
+        plain, compressed, size = pack(text)
+
+        assert plain is None
+        assert size == len(text.encode())
+        assert unpack(plain, compressed) == text
+        assert b''.join(iter_bytes(plain, compressed, 10, 99, chunk_size=16)) == text.encode()[10:100]
+
+    @pytest.mark.asyncio
+    async def test_get_card_content_from_bd(self, func_async_session, monkeypatch):
+        monkeypatch.setattr('app.DAO.get_db_session', lambda: fake_get_db_session(func_async_session))
+        func_async_session.add(Card(title='Big', owner_id=1, content='x' * 5000))
+        await func_async_session.commit()
+
+        text, compressed, size = await CardDAO.get_card_content_from_bd(card_id=1, owner_id=1)
+
+        assert compressed is not None
+        assert size == 5000
+
+
+    @pytest.mark.asyncio
+    async def test_search_matches_compressed_content(self, func_async_session, monkeypatch):
+        monkeypatch.setattr('app.DAO.get_db_session', lambda: fake_get_db_session(func_async_session))
+        monkeypatch.setattr('app.DAO.search_engine', SearchEngine())
+        func_async_session.add_all([Card(title='Big', owner_id=1, content='x' * 5000 + ' Needles'),
+                                    Card(title='Small', owner_id=1, content='needle'),
+                                    Card(title='Other', owner_id=1, content='y' * 5000)])
+        await func_async_session.commit()
+        match_compressed = DAO._match_compressed
+        fetched = []
+
+        def recording(q, rows):
+            fetched.extend(card_id for card_id, _ in rows)
+            return match_compressed(q, rows)
+
+        monkeypatch.setattr('app.DAO._match_compressed', recording)
+        result = await CardDAO.search_cards_in_bd('NEEDLE', 1, full=True)
+
+        assert sorted(card.title for card in result) == ['Big', 'Small']
+        assert fetched == [1]  # сжатые тексты без триграмм запроса не загружаются
+        response = [CardResponse.model_validate(card) for card in result]
+        assert {card.title: card.tags for card in response}['Big'] == []
+        assert any(card.content.endswith('Needles') for card in response)
+
+class TestTemplates:
+    def test_fragment_cache_invalidation(self):
+        cache = FragmentCache(ttl=60)
+        generation = cache.begin(1)
+        cache.invalidate(1)
+        cache.set(1, 'stale', generation)
+
+        assert cache.get(1) is None
+
+        cache.set(1, 'fresh', cache.begin(1))
+        assert cache.get(1) == 'fresh'
+        cache.invalidate(1)
+        assert cache.get(1) is None
+
+    def test_fragment_cache_version(self):
+        cache = FragmentCache(ttl=60)
+        cache.set(1, 'list', cache.begin(1), version=(1, 'a'))
+
+        assert cache.get(1, (1, 'a')) == 'list'
+        # Запись в другом воркере меняет версию в БД, без invalidate в этом.
+        assert cache.get(1, (2, 'b')) is None
+
+    @pytest.mark.asyncio
+    async def test_render_cards_fragment(self):
+        html = await templates.get_template('cards.html').render_async(
+            cards=[Card(id=1, title='<b>Заметка</b>')])
+
+        assert 'data-id="1"' in html
+        assert '&lt;b&gt;Заметка&lt;/b&gt;' in html
+
+
+class TestAssets:
+    def test_build_assets(self, tmp_path):
+        src, dest = tmp_path / 'static', tmp_path / 'build'
+        (src / 'css').mkdir(parents=True)
+        (src / 'css' / 'site.css').write_text('body { margin: 0; }\n' * 50)
+
+        manifest = build_assets(str(src), str(dest))
+        hashed = manifest['css/site.css']
+
+        assert hashed != 'css/site.css'
+        assert (dest / hashed).exists()
+        assert (dest / f'{hashed}.gz').exists()
+        assert asset_url('css/site.css') == f'/assets/{hashed}'
+        assert asset_url('css/missing.css') == '/static/css/missing.css'
+
+        for version in ('v2', 'v3'):
+            (src / 'css' / 'site.css').write_text(f'body {{ margin: 0; }} /* {version} */\n' * 50)
+            build_assets(str(src), str(dest))
+        assert not (dest / hashed).exists()
+        assert not (dest / f'{hashed}.gz').exists()
+        assert len(list((dest / 'css').iterdir())) == 4  # текущая и предыдущая сборка с .gz
+        load_manifest({})
+
+
+class TestWriteBehind:
+    @pytest.mark.asyncio
+    async def test_patches_coalesce_into_one_write(self):
+        batches = []
+
+        async def writer(items):
+            batches.append(items)
+            return {}
+
+        buffer = WriteBehindBuffer(writer, durability='async')
+        await buffer.submit(1, 10, {'title': 'a'})
+        await buffer.submit(1, 10, {'content': 'b'})
+        await buffer.submit(1, 10, {'title': 'c'})
+
+        assert buffer.overlay(1, 10) == {'title': 'c', 'content': 'b'}
+        assert await buffer.flush() == 1
+        assert batches == [[(1, 10, {'title': 'c', 'content': 'b'})]]
+        assert buffer.overlay(1, 10) is None
+
+    @pytest.mark.asyncio
+    async def test_read_during_flush_sees_patch(self):
+        started, release = asyncio.Event(), asyncio.Event()
+
+        async def writer(items):
+            started.set()
+            await release.wait()
+            return {}
+
+        buffer = WriteBehindBuffer(writer, durability='async')
+        await buffer.submit(1, 10, {'title': 'a'})
+        flush = asyncio.create_task(buffer.flush())
+        await started.wait()
+
+        assert buffer.overlay(1, 10) == {'title': 'a'}
+        assert buffer.has(1, 10)
+        await buffer.submit(1, 10, {'content': 'b'})
+        assert buffer.overlay(1, 10) == {'title': 'a', 'content': 'b'}
+
+        only = asyncio.create_task(buffer.flush((1, 10)))
+        await asyncio.sleep(0)
+        assert not only.done()
+        release.set()
+        await flush
+        assert await only == 1
+        assert buffer.overlay(1, 10) is None
+        assert not buffer.has(1, 10)
+
+    @pytest.mark.asyncio
+    async def test_update_card_write_behind(self, func_async_session, sample_card, monkeypatch):
+        monkeypatch.setattr('app.DAO.get_db_session', lambda: fake_get_db_session(func_async_session))
+        monkeypatch.setattr('app.DAO.get_db_transaction', lambda: fake_get_db_transaction(func_async_session))
+        monkeypatch.setattr('app.DAO.settings.WRITE_BEHIND_ENABLED', True)
+        buffer = WriteBehindBuffer(CardDAO.write_pending_to_bd, durability='async')
+        monkeypatch.setattr('app.DAO.write_behind', buffer)
+
+        assert await CardDAO.update_card_in_bd(1, 1, CardContent(title='Draft'))
+        assert await CardDAO.update_card_in_bd(1, 1, CardContent(title='Final', content='text'))
+        assert not await CardDAO.update_card_in_bd(99, 1, CardContent(title='None'))
+
+        card = await CardDAO.get_card_by_id_from_bd(1, 1)
+        assert card.title == 'Final'
+
+        assert await buffer.flush() == 1
+        stored = await func_async_session.scalar(select(Card.title).where(Card.id == 1))
+        assert stored == 'Final'
+
+
+class TestSoftDelete:
+    @pytest.mark.asyncio
+    async def test_delete_and_restore(self, func_async_session, sample_card, monkeypatch):
+        monkeypatch.setattr('app.DAO.get_db_session', lambda: fake_get_db_session(func_async_session))
+        monkeypatch.setattr('app.DAO.get_db_transaction', lambda: fake_get_db_transaction(func_async_session))
+
+        await CardDAO.delete_card_from_bd(card_id=1, owner_id=1)
+
+        assert await CardDAO.get_cards_from_bd(owner_id=1) == []
+        assert await func_async_session.scalar(select(Card.id).where(Card.id == 1)) == 1
+
+        card = await CardDAO.restore_card_in_bd(card_id=1, owner_id=1)
+
+        assert card.deleted_at is None
+        assert len(await CardDAO.get_cards_from_bd(owner_id=1)) == 1
+
+    @pytest.mark.asyncio
+    async def test_purge_deleted_cards(self, func_async_session, monkeypatch):
+        monkeypatch.setattr('app.maintenance.get_db_transaction', lambda: fake_get_db_transaction(func_async_session))
+        tag = Tag(tag_name='old')
+        old = Card(title='Old', owner_id=1, tags=[tag],
+                   deleted_at=datetime.now(timezone.utc) - timedelta(days=40))
+        recent = Card(title='Recent', owner_id=1, deleted_at=datetime.now(timezone.utc))
+        func_async_session.add_all([old, recent])
+        await func_async_session.commit()
+
+        assert await purge_deleted_cards(retention_days=30) == 1
+
+        titles = (await func_async_session.execute(select(Card.title))).scalars().all()
+        assert titles == ['Recent']
+
+
+class TestProfiling:
+    @staticmethod
+    async def call(app, headers):
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {'type': 'http', 'method': 'GET', 'path': '/action/get_card/', 'query_string': b'',
+                 'headers': headers}
+        await app(scope, receive, send)
+        return dict(messages[0]['headers'])
+
+    @pytest.mark.asyncio
+    async def test_profile_by_admin_header(self, tmp_path):
+        async def endpoint(scope, receive, send):
+            await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+            await send({'type': 'http.response.body', 'body': json.dumps(list(range(100))).encode()})
+
+        store = ProfileStore(str(tmp_path), max_files=2)
+        app = ProfilingMiddleware(endpoint, store, token='secret-token')
+
+        assert b'x-profile-id' not in await self.call(app, [(b'x-profile', b'wrong')])
+        for _ in range(3):
+            headers = await self.call(app, [(b'x-profile', b'secret-token')])
+
+        profiles = store.list()
+        assert len(profiles) == 2
+        assert profiles[0]['id'] == headers[b'x-profile-id'].decode()
+        assert set(profiles[0]['categories']) >= {'sql', 'serialization', 'templates', 'jwt', 'bcrypt'}
+        assert store.prof_path(profiles[0]['id']) is not None
+        assert store.prof_path('../secret') is None
+
+    @pytest.mark.asyncio
+    async def test_categories_are_wall_time(self, tmp_path, func_async_session):
+        instrument()
+
+        async def endpoint(scope, receive, send):
+            await func_async_session.execute(select(Card.id))
+            with timed('templates'):
+                await asyncio.sleep(0.05)
+            await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+            await send({'type': 'http.response.body', 'body': b''})
+
+        store = ProfileStore(str(tmp_path))
+        app = ProfilingMiddleware(endpoint, store, token='secret-token')
+        await self.call(app, [(b'x-profile', b'secret-token')])
+
+        categories = store.list()[0]['categories']
+        assert categories['templates'] >= 50
+        assert categories['sql'] > 0
+
+
+class TestMaintenance:
+    @pytest.mark.asyncio
+    async def test_check_tag_snapshots(self, func_async_session, monkeypatch):
+        monkeypatch.setattr('app.DAO.get_db_transaction', lambda: fake_get_db_transaction(func_async_session))
+        monkeypatch.setattr('app.maintenance.get_db_transaction', lambda: fake_get_db_transaction(func_async_session))
+        card = await CardDAO.create_card_in_bd(title='string', subtitle='string', content='string', owner_id=1,
+                                               attr={'tag': ['b', 'a']})
+        assert await check_tag_snapshots() == 0
+
+        await func_async_session.execute(update(Card).where(Card.id == card.id).values(tag_names=['c']))
+        await func_async_session.commit()
+
+        assert await check_tag_snapshots(repair=True) == 1
+        assert await check_tag_snapshots() == 0
+
+    @pytest.mark.asyncio
+    async def test_orphan_collector(self, func_async_session, monkeypatch):
+        monkeypatch.setattr('app.DAO.get_db_transaction', lambda: fake_get_db_transaction(func_async_session))
+        monkeypatch.setattr('app.maintenance.get_db_transaction', lambda: fake_get_db_transaction(func_async_session))
+        await CardDAO.create_card_in_bd(title='string', subtitle='string', content='string', owner_id=1,
+                                        attr={'cat': 'used', 'tag': ['used']})
+        func_async_session.add_all([Tag(tag_name='orphan'), Category(cat_name='orphan')])
+        await func_async_session.commit()
+
+        collector = OrphanCollector()
+        first = await collector.collect()
+        second = await collector.collect()
+
+        assert (first.tags, first.categories) == (0, 0)
+        assert (second.tags, second.categories) == (1, 1)
+        tags = await func_async_session.execute(select(Tag.tag_name))
+        assert tags.scalars().all() == ['used']
+
+    @pytest.mark.asyncio
+    async def test_create_card_retries_when_tag_collected(self, func_async_session, monkeypatch):
+        await func_async_session.execute(text('PRAGMA foreign_keys=ON'))
+        monkeypatch.setattr('app.DAO.get_db_transaction', lambda: fake_get_db_transaction(func_async_session))
+        func_async_session.add_all([User(username='u', hashed_password='x', email='u@mail.ru'),
+                                    Tag(tag_name='orphan')])
+        await func_async_session.commit()
+
+        get_or_create_tags = Service.get_or_create_tags
+        calls = []
+
+        async def interleaved(session, names):
+            tags = await get_or_create_tags(session, names)
+            if not calls:
+                # Сборщик удаляет тэг-сироту между SELECT запроса и вставкой card_tag.
+                await session.execute(delete(Tag.__table__).where(Tag.__table__.c.tag_name == 'orphan'))
+            calls.append(names)
+            return tags
+
+        monkeypatch.setattr(Service, 'get_or_create_tags', interleaved)
+        card = await CardDAO.create_card_in_bd(title='a', subtitle='a', content='a', owner_id=1,
+                                               attr={'tag': ['orphan']})
+
+        assert len(calls) == 2
+        links = await func_async_session.execute(
+            select(Tag.tag_name).join(tag_table, tag_table.c.tag_id == Tag.id).where(tag_table.c.card_id == card.id))
+        assert links.scalars().all() == ['orphan']
+
+    @pytest.mark.asyncio
+    async def test_cards_version_bumped_by_every_write(self, func_async_session, monkeypatch):
+        monkeypatch.setattr('app.DAO.get_db_transaction', lambda: fake_get_db_transaction(func_async_session))
+        monkeypatch.setattr('app.DAO.get_db_session', lambda: fake_get_db_session(func_async_session))
+        monkeypatch.setattr('app.maintenance.get_db_transaction', lambda: fake_get_db_transaction(func_async_session))
+        assert await CardDAO.get_cards_version_from_bd(1) == 0
+
+        card = await CardDAO.create_card_in_bd(title='a', subtitle='a', content='a', owner_id=1)
+        await CardDAO.update_card_in_bd(card_id=card.id, owner_id=1, data=CardContent(title='b'))
+        await CardDAO.write_pending_to_bd([(1, card.id, {'content': 'c'})])
+        assert await CardDAO.get_cards_version_from_bd(1) == 3
+
+        await func_async_session.execute(update(OwnerCardCount).values(total=5))
+        await func_async_session.commit()
+        assert await reconcile_counters() == 1
+        assert await CardDAO.get_cards_version_from_bd(1) == 3
+
+    @pytest.mark.asyncio
+    async def test_reconcile_locks_owner_rows(self, func_async_session, monkeypatch):
+        monkeypatch.setattr('app.maintenance.get_db_transaction', lambda: fake_get_db_transaction(func_async_session))
+        locked = []
+
+        async def recording(session, owner_ids):
+            locked.append(sorted(owner_ids))
+            await lock_owners(session, owner_ids)
+
+        monkeypatch.setattr('app.maintenance.lock_owners', recording)
+        func_async_session.add(Card(title='a', owner_id=7, tag_names=['x']))
+        await func_async_session.commit()
+
+        assert await reconcile_counters() == 1
+        assert locked == [[7]]
+        row = (await func_async_session.execute(select(OwnerCardCount.total, OwnerCardCount.version))).one()
+        assert tuple(row) == (1, 0)
+
+    @pytest.mark.asyncio
+    async def test_card_counters(self, func_async_session, monkeypatch):
+        monkeypatch.setattr('app.DAO.get_db_transaction', lambda: fake_get_db_transaction(func_async_session))
+        monkeypatch.setattr('app.DAO.get_db_session', lambda: fake_get_db_session(func_async_session))
+        monkeypatch.setattr('app.maintenance.get_db_transaction', lambda: fake_get_db_transaction(func_async_session))
+        card = await CardDAO.create_card_in_bd(title='a', subtitle='a', content='a', owner_id=1,
+                                               attr={'cat': 'work', 'tag': ['x', 'y']})
+        await CardDAO.create_card_in_bd(title='b', subtitle='b', content='b', owner_id=1, attr={'tag': ['x']})
+        await CardDAO.update_card_in_bd(card_id=card.id, owner_id=1, meta=CardMeta(cat='home', tag=['y']))
+
+        counts = await CardDAO.get_card_counts_from_bd(owner_id=1)
+        assert counts == {'total': 2, 'tags': {'x': 1, 'y': 1}, 'categories': {'home': 1}}
+        assert await CardDAO.count_cards_from_bd(owner_id=1, tag='x') == 1
+        assert await reconcile_counters() == 0
+
+        await func_async_session.execute(update(OwnerCardCount).values(total=5))
+        await func_async_session.commit()
+        assert await reconcile_counters() == 1
+        assert await CardDAO.count_cards_from_bd(owner_id=1) == 2
+
+
+class TestMigrations:
+    def test_create_all_stamps_fresh_db(self):
+        engine = create_engine('sqlite://')
+        with engine.begin() as conn:
+            _create_all(conn)
+            heads = ScriptDirectory.from_config(Config(ALEMBIC_INI)).get_heads()
+            assert list(MigrationContext.configure(conn).get_current_heads()) == heads
+
+        legacy = create_engine('sqlite://')
+        with legacy.begin() as conn:
+            Card.__table__.create(conn)
+            with pytest.raises(RuntimeError, match='alembic stamp 0001'):
+                _create_all(conn)
+            assert not inspect(conn).has_table('owner_card_count')
+
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import time
+
+from typing import Any, Awaitable, Callable, Literal, Optional
+
+"""
+Отложенная запись (write-behind) частых правок содержимого карточек.
+
+Патчи одной карточки за окно склеиваются в памяти процесса, фоновая
+задача записывает накопленное одной транзакцией (group commit).
+"""
+
+logger = logging.getLogger(__name__)
+
+Key = tuple[int, int]
+BatchWriter = Callable[[list[tuple[int, int, dict]]], Awaitable[dict[Key, Exception]]]
+
+
+class WriteBehindBuffer:
+    """Буфер отложенной записи патчей title/subtitle/content.
+
+    Режимы долговечности:
+        sync: запрос ждет коммита группы, в которую попал его патч.
+            Ответ означает, что данные в БД; выигрыш - один fsync на группу.
+        async: запрос возвращается сразу. При падении процесса теряются
+            патчи не дольше окна.
+
+    Чтения CardDAO накладывают ожидающие патчи (overlay), поэтому
+    пользователь видит свои записи в том же процессе. Другие воркеры в
+    режиме async видят их после сброса.
+    """
+
+    def __init__(self, writer: BatchWriter, window: float = 1.0,
+                 durability: Literal['async', 'sync'] = 'sync', max_pending: int = 1000,
+                 on_flushed: Optional[Callable[[int], None]] = None):
+        self.writer = writer
+        self.window = window
+        self.durability = durability
+        self.max_pending = max_pending
+        self.on_flushed = on_flushed
+        self._pending: dict[Key, dict[str, Any]] = {}
+        self._waiters: dict[Key, list[asyncio.Future]] = {}
+        # Патчи, которые пишутся прямо сейчас: видны чтениям до возврата writer.
+        self._inflight: dict[Key, dict[str, Any]] = {}
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._closed = False
+
+    def __len__(self) -> int:
+        return len(self._pending) + len(self._inflight)
+
+    def has(self, owner_id: int, card_id: int) -> bool:
+        """Есть ли у карточки ожидающие или записываемые сейчас патчи."""
+        key = (owner_id, card_id)
+        return key in self._pending or key in self._inflight
+
+    def overlay(self, owner_id: int, card_id: int) -> Optional[dict[str, Any]]:
+        """Ожидающие записи поля карточки (включая записываемые сейчас) или None."""
+        key = (owner_id, card_id)
+        inflight, pending = self._inflight.get(key), self._pending.get(key)
+        if inflight is None:
+            return pending
+        if pending is None:
+            return inflight
+        return {**inflight, **pending}
+
+    async def submit(self, owner_id: int, card_id: int, fields: dict[str, Any]) -> None:
+        """Добавляет патч; более поздние значения полей перекрывают ранние.
+
+        Args:
+            owner_id: id пользователя
+            card_id: id карточки
+            fields: Поля title/subtitle/content
+        Raises:
+            Exception: Ошибка записи группы (только в режиме sync)
+        """
+        key = (owner_id, card_id)
+        self._pending.setdefault(key, {}).update(fields)
+        if len(self._pending) >= self.max_pending:
+            self._wakeup.set()
+        if self.durability == 'sync':
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.setdefault(key, []).append(future)
+            await future
+
+    def discard(self, owner_id: int, card_id: int) -> None:
+        """Отбрасывает патчи карточки (карточка удалена)."""
+        key = (owner_id, card_id)
+        self._pending.pop(key, None)
+        for future in self._waiters.pop(key, ()):
+            if not future.done():
+                future.set_result(None)
+
+    async def flush(self, only: Optional[Key] = None) -> int:
+        """Записывает ожидающие патчи (все или одной карточки).
+
+        Сбросы идут по одному: flush(only) дожидается записи, которая уже
+        идет, поэтому после него в БД нет более старых патчей карточки.
+
+        Returns:
+            int: Количество записанных карточек
+        """
+        async with self._lock:
+            if only is None:
+                batch, self._pending = self._pending, {}
+                waiters, self._waiters = self._waiters, {}
+            else:
+                fields = self._pending.pop(only, None)
+                batch = {only: fields} if fields is not None else {}
+                waiters = {only: self._waiters.pop(only, [])}
+            if not batch:
+                return 0
+
+            self._inflight.update(batch)
+            started = time.perf_counter()
+            try:
+                errors = await self.writer([(owner_id, card_id, fields)
+                                            for (owner_id, card_id), fields in sorted(batch.items())])
+            except Exception as e:
+                logger.error('Ошибка группового сброса %s карточек: %s', len(batch), e, exc_info=True)
+                if self.durability == 'async':
+                    # Ответы уже отданы: возвращаем патчи в буфер до следующего сброса,
+                    # более новые значения полей остаются поверх.
+                    for key, fields in batch.items():
+                        self._pending[key] = {**fields, **self._pending.get(key, {})}
+                    return 0
+                errors = dict.fromkeys(batch, e)
+            finally:
+                for key in batch:
+                    self._inflight.pop(key, None)
+
+            for key in batch:
+                error = errors.get(key)
+                if error is not None and self.durability == 'async':
+                    logger.error('Потерян патч карточки %s: %s', key[1], error)
+                for future in waiters.get(key, ()):
+                    if future.done():
+                        continue
+                    if error is None:
+                        future.set_result(None)
+                    else:
+                        future.set_exception(error)
+            if self.on_flushed is not None:
+                for owner_id in {owner_id for owner_id, _ in batch}:
+                    self.on_flushed(owner_id)
+            logger.debug('Сброшено карточек %s за %.3f с', len(batch), time.perf_counter() - started)
+            return len(batch) - len(errors)
+
+    async def run(self) -> None:
+        """Фоновый цикл: сброс раз в окно или при переполнении буфера."""
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.window)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception('Ошибка фонового сброса')
+
+    async def close(self) -> None:
+        """Останавливает фоновый цикл и сбрасывает все ожидающие патчи.
+
+        Сброс, который уже идет, не прерывается: flush ждет его завершения.
+        """
+        self._closed = True
+        self._wakeup.set()
+        await self.flush()
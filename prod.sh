@@ -0,0 +1,6 @@
+#!/bin/bash
+
+echo "Запуск сервера (production)..."
+
+source ./.venv/bin/activate
+python -m app.server "$@"